@@ -0,0 +1,73 @@
+"""
+Предохранитель (circuit breaker) для запросов в базу.
+После failure_threshold ошибок или таймаутов подряд запросы reset_timeout секунд
+не отправляются вовсе, а сразу падают с CircuitOpenError. Затем пропускается
+один пробный запрос: успех закрывает предохранитель, ошибка снова открывает.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._opened_at = None
+        self._probe = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    async def call(self, factory: Callable[[], Awaitable], timeout: float = None):
+        """Выполняет factory() не дольше timeout секунд"""
+        state = self.state
+        if state == self.OPEN or (state == self.HALF_OPEN and self._probe):
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit is open after {self.failures} failures")
+
+        probe = state == self.HALF_OPEN
+        if probe:
+            self._probe = True
+        try:
+            result = await asyncio.wait_for(factory(), timeout)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+            self._failure()
+            raise
+        finally:
+            # флаг снимает только сам пробный запрос, а не запрос, начатый до открытия
+            if probe:
+                self._probe = False
+
+        self.failures = 0
+        self._opened_at = None
+        return result
+
+    def _failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold or self._opened_at is not None:
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            'state': (self.CLOSED, self.HALF_OPEN, self.OPEN).index(self.state),
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+        }
@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру кэш с вытеснением давно неиспользуемых записей (LRU)
+    и временем жизни записей (TTL, в секундах; None - записи не протухают).
+    Протухшие записи не удаляются, пока их не вытеснят: get_stale отдает их,
+    когда свежую копию взять неоткуда.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            value, expires = item
+            if expires is not None and expires <= time.monotonic():
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key, default=None):
+        """
+        (значение, свежее ли оно). Протухшее значение тоже отдается, с fresh=False,
+        его стоит отдать клиенту и обновить в фоне.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default, False
+
+            value, expires = item
+            self._data.move_to_end(key)
+            if expires is not None and expires <= time.monotonic():
+                self.misses += 1
+                self.stale_hits += 1
+                return value, False
+
+            self.hits += 1
+            return value, True
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        """
+        Удаляет записи, для ключей которых predicate(key) истинно.
+        Без predicate очищает кэш целиком. Возвращает число удаленных записей.
+        """
+        with self._lock:
+            if predicate is None:
+                removed = len(self._data)
+                self._data.clear()
+                return removed
+
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits,
+            'hit_ratio': self.hits / total if total else 0.,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
@@ -0,0 +1,77 @@
+import gzip
+from typing import Optional
+
+from app.cache import LRUCache
+from app.metrics import register_collector
+from app.settings.consts import COMPRESSION_MIN_SIZE, GZIP_LEVEL, BROTLI_QUALITY, COMPRESSED_CACHE_SIZE
+
+try:
+    import brotli
+except ImportError:
+    # brotli - необязательная зависимость, без нее отдаем gzip
+    brotli = None
+
+SETTINGS = {
+    "min_size": COMPRESSION_MIN_SIZE,
+    "gzip_level": GZIP_LEVEL,
+    "brotli_quality": BROTLI_QUALITY,
+}
+
+# Сжатые варианты ответов: (etag, encoding) -> bytes.
+# Уровни отдаются много раз, поэтому сжимаем каждый один раз.
+COMPRESSED = LRUCache(maxsize=COMPRESSED_CACHE_SIZE)
+register_collector(lambda: {
+    f"compressed_cache_{name}": value for name, value in COMPRESSED.stats().items() if name != 'ttl'
+})
+
+
+def init_compression(config):
+    SETTINGS["min_size"] = config["compression_min_size"]
+    SETTINGS["gzip_level"] = config["gzip_level"]
+    SETTINGS["brotli_quality"] = config["brotli_quality"]
+    COMPRESSED.maxsize = config["compressed_cache_size"]
+    COMPRESSED.invalidate()
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Выбирает br или gzip по заголовку Accept-Encoding с учетом q-значений"""
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        coding = parts[0].strip().lower()
+        q = 1.
+        for param in parts[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.
+        weights[coding] = q
+
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    candidates = [
+        coding for coding in supported
+        if weights.get(coding, weights.get("*", 0.)) > 0
+    ]
+    if not candidates:
+        return None
+    # при равных весах предпочитаем br
+    return max(candidates, key=lambda coding: (weights.get(coding, weights.get("*", 0.)), coding == "br"))
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=SETTINGS["brotli_quality"])
+    return gzip.compress(body, compresslevel=SETTINGS["gzip_level"])
+
+
+def compress_cached(body: bytes, encoding: str, key: str) -> bytes:
+    compressed = COMPRESSED.get((key, encoding))
+    if compressed is None:
+        compressed = compress(body, encoding)
+        COMPRESSED.set((key, encoding), compressed)
+    return compressed
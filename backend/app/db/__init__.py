@@ -1,4 +1,6 @@
-from app.db.wrappers import MongoDB
+from app.db.indexes import ensure_indexes, ensure_model_indexes, check_query_plans
+from app.db.queries import CREATE_TIMESERIES_TABLES
+from app.db.wrappers import ClickHouse, MongoDB, MySQL
 
 DBS = {}
 
@@ -11,6 +13,31 @@ async def init_databases(config):
     """
     DBS["mongo"] = await MongoDB.init_async(config["mongo"])
 
+    await ensure_indexes(DBS["mongo"])
+    problems = await check_query_plans(DBS["mongo"])
+    if problems and config["mongo"]["require_indexes"]:
+        raise RuntimeError(f"Queries without index: {problems}")
+
+    # ClickHouse нужен только для временных рядов, без CH_URL не подключаемся
+    if "clickhouse" in config:
+        DBS["clickhouse"] = await ClickHouse.init_async(config["clickhouse"])
+        for query in CREATE_TIMESERIES_TABLES:
+            await DBS["clickhouse"]["client"].execute(query)
+
+    # пул соединений MySQL, если задан MYSQL_HOST
+    if "mysql" in config:
+        from app.metrics import COLLECTORS, register_collector
+
+        DBS["mysql"] = await MySQL.init_async(config["mysql"])
+        if _mysql_pool_metrics not in COLLECTORS:
+            register_collector(_mysql_pool_metrics)
+
+
+def _mysql_pool_metrics():
+    if "mysql" not in DBS:
+        return {}
+    return {f"mysql_pool_{name}": value for name, value in MySQL.pool_stats(DBS["mysql"]).items()}
+
 
 async def shutdown_databases():
     """
@@ -18,3 +45,7 @@ async def shutdown_databases():
     await MySQL.close_async(DBS["mysql"])
     """
     await MongoDB.close_async(DBS["mongo"])
+    if "clickhouse" in DBS:
+        await ClickHouse.close_async(DBS.pop("clickhouse"))
+    if "mysql" in DBS:
+        await MySQL.close_async(DBS.pop("mysql"))
@@ -0,0 +1,99 @@
+import logging
+from typing import List
+
+import motor.motor_asyncio as aiomotor
+import pymongo as pym
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Индексы коллекций уровней "MODEL_{days_back}_{days_forward}"
+MODEL_INDEXES = [
+    ([("level_id", pym.ASCENDING)], True),
+]
+
+# Индексы коллекций с сырыми данными: (ключи, unique)
+DATA_INDEXES = {
+    "GDELT": [([("Ticker", pym.ASCENDING), ("datetime", pym.ASCENDING)], True)],
+    "YFINANCE": [([("Ticker", pym.ASCENDING), ("Date", pym.ASCENDING)], True)],
+    # ответы игроков (см. app.routes.sessions)
+    "ANSWERS": [([("session_id", pym.ASCENDING)], False)],
+    # верх таблицы лидеров: ключи и порядок те же, что в сортировке _refresh_leaderboard
+    "SESSIONS": [([("user_score", pym.DESCENDING), ("model_score", pym.DESCENDING), ("_id", pym.ASCENDING)], False)],
+}
+
+# Горячие запросы, план которых проверяем при старте
+MODEL_QUERIES = [
+    {"level_id": 0},
+    {"level_id": {"$in": [0, 1]}},
+]
+DATA_QUERIES = {
+    "GDELT": [{"Ticker": "AAPL"}],
+    "YFINANCE": [{"Ticker": "AAPL"}],
+}
+
+
+def _is_model(name: str) -> bool:
+    return name.startswith("MODEL_")
+
+
+async def _create_indexes(coll: aiomotor.AsyncIOMotorCollection, indexes) -> None:
+    for keys, unique in indexes:
+        try:
+            await coll.create_index(keys, unique=unique)
+        except OperationFailure as e:
+            # например, в коллекции уже есть дубликаты
+            logger.warning("Can't create index %s on %s: %s", keys, coll.name, e)
+
+
+async def ensure_model_indexes(db: aiomotor.AsyncIOMotorDatabase, model_ids) -> None:
+    """Индексы коллекций уровней: генератор пересоздает коллекцию через drop, индексы пропадают вместе с ней"""
+    for model_id in model_ids:
+        await _create_indexes(db[model_id], MODEL_INDEXES)
+
+
+async def ensure_indexes(db: aiomotor.AsyncIOMotorDatabase) -> None:
+    """
+    Создает недостающие индексы; create_index для существующего индекса ничего не делает.
+    Индексы DATA_INDEXES создаются всегда: на чистой базе ANSWERS и SESSIONS еще нет,
+    а create_index создаст коллекцию
+    """
+    for name in await db.list_collection_names():
+        if _is_model(name):
+            await _create_indexes(db[name], MODEL_INDEXES)
+    for name, indexes in DATA_INDEXES.items():
+        await _create_indexes(db[name], indexes)
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+async def check_query_plans(db: aiomotor.AsyncIOMotorDatabase) -> List[str]:
+    """
+    Прогоняет explain() для горячих запросов.
+    Возвращает описания запросов, которые превращаются в COLLSCAN.
+    """
+    problems = []
+    for name in await db.list_collection_names():
+        if _is_model(name):
+            queries = MODEL_QUERIES
+        else:
+            queries = DATA_QUERIES.get(name, [])
+
+        for query in queries:
+            explain = await db[name].find(query).explain()
+            stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+            if "COLLSCAN" in stages:
+                problems += [f"{name}: {query}"]
+
+    for problem in problems:
+        logger.warning("Query is a COLLSCAN: %s", problem)
+
+    return problems
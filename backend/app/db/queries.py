@@ -5,3 +5,63 @@
 #     " LEFT JOIN database.table2 as t2 on t1.a = t2.b "
 #     " WHERE t1.robot <> 3 AND t2.b = :injected_param"
 # )
+
+# Дневные ряды тикеров в ClickHouse (заливает data_preprocess/upload_clickhouse.py).
+# ReplacingMergeTree по (ticker, date): повторная заливка дня заменяет строку.
+YFINANCE_COLUMNS = [
+    'open', 'high', 'low', 'close', 'adj_close', 'volume', 'price_change', 'percentage_change',
+]
+GDELT_COLUMNS = [
+    f"{feature}_{stat}"
+    for feature in ('average_tone', 'article_count', 'volume_intensity')
+    for stat in ('min', 'max', 'mean', 'std', 'sum')
+]
+
+TIMESERIES_TABLES = {
+    "yfinance": ("yfinance_daily", YFINANCE_COLUMNS),
+    "gdelt": ("gdelt_daily", GDELT_COLUMNS),
+}
+
+
+def _create_table(table: str, columns: list) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {table} ("
+        " ticker LowCardinality(String), date Date, "
+        + ", ".join(f"{column} Float64" for column in columns)
+        + ") ENGINE = ReplacingMergeTree ORDER BY (ticker, date)"
+    )
+
+
+CREATE_TIMESERIES_TABLES = [_create_table(table, columns) for table, columns in TIMESERIES_TABLES.values()]
+
+
+def _aggregate(column: str) -> str:
+    """Как сворачивать дни в одну точку при прореживании"""
+    if column == 'high' or column.endswith('_max'):
+        return f"max({column})"
+    if column == 'low' or column.endswith('_min'):
+        return f"min({column})"
+    if column == 'volume' or column.endswith('_sum'):
+        return f"sum({column})"
+    return f"avg({column})"
+
+
+def timeseries_query(source: str, columns: list) -> str:
+    """
+    Ряды тикера за период одной строкой колонок-массивов.
+    Дни группируются в корзины по bucket дней от начала периода, в точке - дата первого дня корзины.
+    Параметры (params): ticker, start_date, end_date, bucket.
+    Имена колонок подставляются в текст, поэтому только из TIMESERIES_TABLES.
+    """
+    table, _ = TIMESERIES_TABLES[source]
+    # внутренние псевдонимы не совпадают с колонками, иначе ClickHouse подставит агрегат в WHERE
+    inner = ", ".join(f"{_aggregate(column)} AS point_{column}" for column in columns)
+    outer = ", ".join(f"groupArray(point_{column}) AS {column}" for column in columns)
+    return (
+        f"SELECT groupArray(toString(day)) AS dates, {outer}"
+        f" FROM (SELECT min(date) AS day, {inner}"
+        f" FROM {table} FINAL"
+        " WHERE ticker = {ticker} AND date BETWEEN {start_date} AND {end_date}"
+        " GROUP BY intDiv(date - toDate({start_date}), {bucket})"
+        " ORDER BY day)"
+    )
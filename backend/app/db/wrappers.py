@@ -1,4 +1,5 @@
 import ssl
+from contextlib import asynccontextmanager, contextmanager
 
 class ClickHouse:
     @staticmethod
@@ -10,6 +11,7 @@ class ClickHouse:
         config["url"] = env("CH_URL")
         config["user"] = env("CH_USER")
         config["password"] = env("CH_PASS")
+        config["database"] = env("CH_DB", default="default")
 
         return config
 
@@ -34,6 +36,94 @@ class ClickHouse:
             await connect["session"].close()
 
 
+class MySQLPool:
+    """
+    Потокобезопасный пул соединений MySQLdb для синхронного кода.
+    Соединение MySQLdb нельзя делить между потоками, поэтому каждый поток берет свое через connection().
+    """
+    def __init__(self, config, minsize=1, maxsize=10, acquire_timeout=5.):
+        import queue
+        import threading
+
+        self.config = config
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.acquire_timeout = acquire_timeout
+        self.acquire_timeouts = 0
+        self._free = queue.LifoQueue()
+        self._size = 0
+        self._lock = threading.Lock()
+        for _ in range(minsize):
+            self._free.put(self._connect())
+        self._size = minsize
+
+    def _connect(self):
+        import MySQLdb
+
+        return MySQLdb.connect(**self.config)
+
+    def _acquire(self):
+        import queue
+
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_grow = self._size < self.maxsize
+            if can_grow:
+                # место под соединение занимаем сразу, чтобы не превысить maxsize
+                self._size += 1
+        if can_grow:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+
+        try:
+            return self._free.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            self.acquire_timeouts += 1
+            raise TimeoutError(f"No free MySQL connection in {self.acquire_timeout}s")
+
+    @contextmanager
+    def connection(self):
+        connection = self._acquire()
+        try:
+            connection.ping(True)
+            yield connection
+        except Exception:
+            # соединение в неизвестном состоянии, в пул не возвращаем
+            connection.close()
+            with self._lock:
+                self._size -= 1
+            raise
+        else:
+            self._free.put(connection)
+
+    def stats(self):
+        return {
+            "size": self._size,
+            "freesize": self._free.qsize(),
+            "maxsize": self.maxsize,
+            "acquire_timeouts": self.acquire_timeouts,
+        }
+
+    def close(self):
+        import queue
+
+        while True:
+            try:
+                self._free.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._size -= 1
+
+
 class MySQL:
     @staticmethod
     def read_settings_async():
@@ -54,26 +144,75 @@ class MySQL:
 
         config["db"] = env("MYSQL_DB")
 
+        # настройки пула, в соединение не передаются
+        config["pool"] = {
+            "minsize": env.int("MYSQL_POOL_MIN_SIZE", default=1),
+            "maxsize": env.int("MYSQL_POOL_MAX_SIZE", default=10),
+            # сколько секунд ждать свободное соединение
+            "acquire_timeout": env.float("MYSQL_ACQUIRE_TIMEOUT", default=5.),
+            # соединения старше стольких секунд пересоздаются (wait_timeout у сервера)
+            "pool_recycle": env.int("MYSQL_POOL_RECYCLE", default=3600),
+        }
+
         return config
 
     @staticmethod
     async def init_async(config):
         import aiomysql
 
-        config["autocommit"] = True
-        connection = await aiomysql.connect(**config)
-        cursor = await connection.cursor()
+        config = dict(config)
+        pool_config = config.pop("pool", {})
+        pool = await aiomysql.create_pool(
+            minsize=pool_config.get("minsize", 1),
+            maxsize=pool_config.get("maxsize", 10),
+            pool_recycle=pool_config.get("pool_recycle", -1),
+            autocommit=True,
+            **config
+        )
 
         connect = {
-            "cursor": cursor,
-            "connection": connection
+            "pool": pool,
+            "acquire_timeout": pool_config.get("acquire_timeout", 5.),
+            "acquire_timeouts": 0,
         }
         return connect
 
+    @staticmethod
+    @asynccontextmanager
+    async def acquire(connect):
+        """
+        Соединение из пула на время запроса:
+            async with MySQL.acquire(DBS["mysql"]) as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(...)
+        """
+        import asyncio
+
+        pool = connect["pool"]
+        try:
+            connection = await asyncio.wait_for(pool.acquire(), connect["acquire_timeout"])
+        except asyncio.TimeoutError:
+            connect["acquire_timeouts"] += 1
+            raise
+        try:
+            yield connection
+        finally:
+            pool.release(connection)
+
+    @staticmethod
+    def pool_stats(connect):
+        pool = connect["pool"]
+        return {
+            "size": pool.size,
+            "freesize": pool.freesize,
+            "maxsize": pool.maxsize,
+            "acquire_timeouts": connect["acquire_timeouts"],
+        }
+
     @staticmethod
     async def close_async(connect):
-        await connect["cursor"].close()
-        connect["connection"].close()
+        connect["pool"].close()
+        await connect["pool"].wait_closed()
 
     @staticmethod
     def read_settings():
@@ -81,21 +220,24 @@ class MySQL:
 
     @staticmethod
     def init(config):
-        import MySQLdb
-
+        config = dict(config)
+        pool_config = config.pop("pool", {})
         config["autocommit"] = True
-        connection = MySQLdb.connect(**config)
-        cursor = connection.cursor()
 
+        pool = MySQLPool(
+            config,
+            minsize=pool_config.get("minsize", 1),
+            maxsize=pool_config.get("maxsize", 10),
+            acquire_timeout=pool_config.get("acquire_timeout", 5.),
+        )
         connect = {
-            "connection": connection,
-            "cursor": cursor
+            "pool": pool,
         }
         return connect
 
     @staticmethod
     def close(connect):
-        connect["cursor"].close()
+        connect["pool"].close()
 
 
 class MongoDB:
@@ -107,18 +249,50 @@ class MongoDB:
         config = dict()
         config["connection_string"] = env("MONGODB_CONNECTION_STRING")
         config["db"] = env("MONGODB_DB")
+        config["ssl_ca_certs"] = env("MONGODB_SSL_CA_CERTS", default="../additional/YandexInternalRootCA.crt")
+        # не стартуем, если горячие запросы идут без индекса
+        config["require_indexes"] = env.bool("MONGODB_REQUIRE_INDEXES", default=False)
+
+        # настройки клиента, передаются в AsyncIOMotorClient как есть
+        config["client"] = {
+            "maxPoolSize": env.int("MONGODB_MAX_POOL_SIZE", default=200),
+            "minPoolSize": env.int("MONGODB_MIN_POOL_SIZE", default=10),
+            "maxIdleTimeMS": env.int("MONGODB_MAX_IDLE_TIME_MS", default=300000),
+            "waitQueueTimeoutMS": env.int("MONGODB_WAIT_QUEUE_TIMEOUT_MS", default=2000),
+            "serverSelectionTimeoutMS": env.int("MONGODB_SERVER_SELECTION_TIMEOUT_MS", default=5000),
+            "connectTimeoutMS": env.int("MONGODB_CONNECT_TIMEOUT_MS", default=5000),
+            "socketTimeoutMS": env.int("MONGODB_SOCKET_TIMEOUT_MS", default=10000),
+            # snappy и zstd требуют python-snappy / zstandard, zlib есть всегда
+            "compressors": env("MONGODB_COMPRESSORS", default="zlib"),
+            "zlibCompressionLevel": env.int("MONGODB_ZLIB_COMPRESSION_LEVEL", default=1),
+        }
+        # клиент читает с primary: сессии, статистика и каталог не должны отставать.
+        # Уровни MODEL_* только читаются, их можно брать с вторичных реплик (см. MongoLevelStore)
+        config["levels_read_preference"] = env("MONGODB_READ_PREFERENCE", default="secondaryPreferred")
 
         return config
 
     @staticmethod
     async def init_async(config):
+        import logging
         import motor.motor_asyncio as aiomotor
 
         conn = aiomotor.AsyncIOMotorClient(
             config["connection_string"],
-            ssl_ca_certs="../additional/YandexInternalRootCA.crt",
-            ssl_cert_reqs=ssl.CERT_REQUIRED
+            ssl_ca_certs=config["ssl_ca_certs"],
+            ssl_cert_reqs=ssl.CERT_REQUIRED,
+            **config["client"]
+        )
+
+        pool = conn.delegate.options.pool_options
+        logging.getLogger(__name__).info(
+            "MongoDB pool: max_pool_size=%s min_pool_size=%s max_idle_time=%s wait_queue_timeout=%s "
+            "connect_timeout=%s socket_timeout=%s compressors=%s levels_read_preference=%s",
+            pool.max_pool_size, pool.min_pool_size, pool.max_idle_time_seconds, pool.wait_queue_timeout,
+            pool.connect_timeout, pool.socket_timeout, config["client"]["compressors"],
+            config["levels_read_preference"],
         )
+
         db = conn[config["db"]]
         return db
 
@@ -0,0 +1,143 @@
+"""
+Метрики в текстовом формате Prometheus без внешних зависимостей.
+Метрики у каждого процесса свои: при нескольких воркерах /metrics отдает данные того воркера,
+на который попал запрос.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.routing import Match
+
+from app.settings.logging import ACCESS_LOGGER, format_log_message
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple, list] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            # счетчики по корзинам, затем сумма и количество
+            item = self._values.setdefault(labels, [0] * len(self.buckets) + [0., 0])
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                item[i] += 1
+            item[-2] += value
+            item[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = {labels: list(item) for labels, item in self._values.items()}
+
+        for labels, item in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, item):
+                cumulative += count
+                lines += [f"{self.name}_bucket{_format_labels(self.labels + ('le',), labels + (bound,))} {cumulative}"]
+            lines += [
+                f"{self.name}_bucket{_format_labels(self.labels + ('le',), labels + ('+Inf',))} {item[-1]}",
+                f"{self.name}_sum{_format_labels(self.labels, labels)} {item[-2]}",
+                f"{self.name}_count{_format_labels(self.labels, labels)} {item[-1]}",
+            ]
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, value=1):
+        self.value += value
+
+    def dec(self, value=1):
+        self.value -= value
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Время обработки запроса", labels=("method", "route", "status"),
+)
+IN_FLIGHT = Gauge("http_requests_in_flight", "Запросы в обработке")
+# этапы обработки: db_fetch, model_parse, serialization
+STAGE_LATENCY = Histogram("stage_duration_seconds", "Время этапов обработки запроса", labels=("stage",))
+MONGO_LATENCY = Histogram("mongo_operation_duration_seconds", "Время запросов в MongoDB", labels=("operation",))
+
+CLICKHOUSE_LATENCY = Histogram("clickhouse_query_duration_seconds", "Время запросов в ClickHouse", labels=("query",))
+
+METRICS = [REQUEST_LATENCY, IN_FLIGHT, STAGE_LATENCY, MONGO_LATENCY, CLICKHOUSE_LATENCY]
+
+# функции, возвращающие {имя_метрики: значение} для gauge-метрик, например статистика кэшей
+COLLECTORS: List[Callable[[], Dict[str, float]]] = []
+
+
+def register_collector(collector: Callable[[], Dict[str, float]]):
+    COLLECTORS.append(collector)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    for collector in COLLECTORS:
+        for name, value in collector().items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def route_path(request) -> Optional[str]:
+    """
+    Шаблон пути (/backend/levels/{model_id}/{level_id}) для запроса.
+    starlette 0.13 не кладет найденный route в scope, поэтому ищем его сами
+    """
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return None
+
+
+async def metrics_middleware(request, call_next):
+    """Замеряет время запросов и пишет access-лог"""
+    IN_FLIGHT.inc()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        IN_FLIGHT.dec()
+    duration = time.perf_counter() - start
+
+    # шаблон пути, а не сам путь, чтобы не плодить метки на каждый level_id
+    route = route_path(request)
+    REQUEST_LATENCY.observe(duration, request.method, route or "unmatched", response.status_code)
+    ACCESS_LOGGER.info(await format_log_message(request, response, duration, route))
+    return response
@@ -1,9 +1,12 @@
 """
 Here you can write your pydantic models
 """
-from typing import List, Dict, Tuple
+from datetime import date
+from typing import List, Dict, Literal, Tuple, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, conlist
+
+from app.settings.consts import MAX_LEVELS_BATCH
 
 
 class GetModelNamesResponse(BaseModel):
@@ -15,6 +18,27 @@ class GetLevelRequest(BaseModel):
     level_id: int
 
 
+class GetLevelsRequest(BaseModel):
+    """
+    Либо явный список level_ids, либо полуинтервал [start, stop).
+    С seed это номера шагов в перемешанном порядке уровней, а не level_id.
+    """
+    model_id: str
+    level_ids: Optional[conlist(int, max_items=MAX_LEVELS_BATCH)] = None
+    start: Optional[int] = None
+    stop: Optional[int] = None
+    seed: Optional[int] = None
+
+
+class GetRandomLevelRequest(BaseModel):
+    """
+    Без seed - случайный уровень, с seed - уровень шага step в перемешанном для этого seed порядке
+    """
+    model_id: str
+    seed: Optional[int] = None
+    step: int = 0
+
+
 class GetLevelMongo(BaseModel):
     """
     выход:
@@ -39,6 +63,7 @@ class GetLevelMongo(BaseModel):
 
 
 class GetLevelResponse(BaseModel):
+    level_id: int = None
     dates: List[str]
     prices: List[float]
     tones: List[float]
@@ -51,6 +76,56 @@ class GetLevelResponse(BaseModel):
     wiki_info: str = None
 
 
+class GetLevelsResponse(BaseModel):
+    data: List[GetLevelResponse]
+
+
+class CreateSessionRequest(BaseModel):
+    name: Optional[str] = None
+
+
+class SessionResponse(BaseModel):
+    session_id: str
+    name: Optional[str] = None
+    user_score: int
+    model_score: int
+    answers: int
+    rank: int
+
+
+class PostAnswerRequest(BaseModel):
+    """answer: 1 - растет, 0 - падает, None - уровень пропущен"""
+    session_id: str
+    model_id: str
+    level_id: int
+    answer: Optional[Literal[0, 1]] = None
+
+
+class LeaderboardResponse(BaseModel):
+    data: List[SessionResponse]
+
+
+class GetTimeseriesRequest(BaseModel):
+    """
+    source - yfinance или gdelt, columns - какие ряды нужны (по умолчанию все).
+    Период прореживается на сервере не больше чем до points точек.
+    """
+    ticker: str
+    start_date: date
+    end_date: date
+    source: str = "yfinance"
+    columns: Optional[List[str]] = None
+    points: int = 500
+
+
+class GetTimeseriesResponse(BaseModel):
+    ticker: str
+    source: str
+    bucket_days: int
+    dates: List[str]
+    data: Dict[str, List[Optional[float]]]
+
+
 def main():
     r = GetLevelMongo(
         level_id=0,
@@ -0,0 +1,68 @@
+import hashlib
+from typing import Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.compression import SETTINGS, choose_encoding, compress_cached
+
+
+class RawJSONResponse(Response):
+    """
+    Отдает уже сериализованный JSON (bytes) как есть,
+    без повторного прохода через pydantic и json-энкодер
+    """
+    media_type = "application/json"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Проверка заголовка If-None-Match (может содержать несколько тегов и W/-префиксы)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+
+def make_etag(body: bytes) -> str:
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """ETag конкретного Content-Encoding: "<md5>" -> "<md5>-gzip" (варианты не должны совпадать)"""
+    if not encoding:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def response_encoding(request: Request, body: bytes) -> Optional[str]:
+    """Каким Content-Encoding отдадим body этому клиенту (None - без сжатия)"""
+    if len(body) < SETTINGS["min_size"]:
+        return None
+    return choose_encoding(request.headers.get("accept-encoding"))
+
+
+def not_modified(request: Request, body: bytes, etag: str, headers: dict = None) -> Optional[Response]:
+    """304, если у клиента уже есть тот же вариант ответа (If-None-Match сверяем с ETag его кодировки)"""
+    tag = encoded_etag(etag, response_encoding(request, body))
+    if not etag_matches(request.headers.get("if-none-match"), tag):
+        return None
+    return Response(status_code=304, headers={**(headers or {}), "ETag": tag, "Vary": "Accept-Encoding"})
+
+
+def json_response(request: Request, body: bytes, headers: dict = None, etag: str = None) -> RawJSONResponse:
+    """
+    Готовый JSON, сжатый под Accept-Encoding клиента, если он больше порога.
+    Сжатые варианты кэшируются по etag (хэшу несжатого тела);
+    если etag передан, в ответ уходит ETag с суффиксом кодировки.
+    """
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    encoding = response_encoding(request, body)
+    if etag:
+        headers["ETag"] = encoded_etag(etag, encoding)
+    if encoding:
+        body = compress_cached(body, encoding, etag or make_etag(body))
+        headers["Content-Encoding"] = encoding
+    return RawJSONResponse(body, headers=headers)
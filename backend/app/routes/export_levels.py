@@ -0,0 +1,12 @@
+from typing import AsyncIterator
+
+from app import store
+
+
+async def _export_levels(model_id: str) -> AsyncIterator[bytes]:
+    """
+    Уровни модели по одному в строке (NDJSON). Курсор читает пачками по EXPORT_BATCH_SIZE,
+    следующая строка готовится только после того, как клиент забрал предыдущую.
+    """
+    async for _, level in store.STORE.iter_levels(model_id):
+        yield level + b"\n"
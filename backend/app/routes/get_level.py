@@ -1,42 +1,122 @@
-from datetime import datetime, timedelta
-from typing import Optional
+import asyncio
+import logging
+from typing import List, Optional
 
-import motor.motor_asyncio as aiomotor
+from app import snapshot, store
+from app.cache import LRUCache
+from app.metrics import register_collector
+from app.settings.consts import LEVEL_CACHE_SIZE, LEVEL_CACHE_TTL
 
-from app.db import DBS
-from app.models import GetLevelMongo, GetLevelResponse
-from app.utils import _get_days
+logger = logging.getLogger(__name__)
 
+# уровни после генерации не меняются, поэтому держим в памяти готовый JSON ответа.
+# Протухшая копия отдается сразу, а свежая забирается в фоне (stale-while-revalidate)
+LEVELS = LRUCache(maxsize=LEVEL_CACHE_SIZE, ttl=LEVEL_CACHE_TTL)
+# уровни, которые сейчас обновляются в фоне, и сами задачи (чтобы их не собрал GC)
+_REFRESHING = set()
+_REFRESH_TASKS = set()
+register_collector(lambda: {
+    f"level_cache_{name}": value for name, value in LEVELS.stats().items() if name != 'ttl'
+})
 
-def _get_date_range(end_date: str, days_back: int):
-    end_date = datetime.strptime(end_date, "%Y-%m-%d")
-    start_date = end_date - timedelta(days=days_back)
-    return {
-        (start_date + timedelta(days=x)).strftime("%Y-%m-%d"): x+1
-        for x in range(0, days_back+1)
-    }
 
+def init_level_cache(config):
+    LEVELS.maxsize = config["level_cache_size"]
+    LEVELS.ttl = config["level_cache_ttl"]
+    LEVELS.invalidate()
 
-async def _get_level(level_id: int, model_id: str) -> Optional[GetLevelResponse]:
-    db: aiomotor.AsyncIOMotorDatabase = DBS['mongo']
-    model_coll: aiomotor.AsyncIOMotorCollection = db.get_collection(model_id.upper())
 
-    level_mongo = await model_coll.find_one({'level_id': level_id})
-    if level_mongo:
-        d_b, _ = _get_days(model_id)
+def invalidate_levels(model_id: str = None, level_id: int = None) -> int:
+    """
+    Сбрасывает кэш уровней: целиком, для модели или для конкретного уровня.
+    Нужно вызывать после перегенерации уровней.
+    """
+    if model_id is None:
+        return LEVELS.invalidate()
 
-        level_mongo = GetLevelMongo.parse_obj(level_mongo)
-        dates = _get_date_range(level_mongo.date, d_b)
+    model_id = model_id.upper()
+    if level_id is None:
+        return LEVELS.invalidate(lambda key: key[0] == model_id)
+    return LEVELS.invalidate(lambda key: key == (model_id, level_id))
 
-        new_news = []
-        for news in level_mongo.news:
-            new_news += [(dates[news[0]], news[1])]
 
-        lvl_json = level_mongo.dict()
-        lvl_json['news'] = new_news
-        return GetLevelResponse(
-            dates=list(dates.keys()),
-            **lvl_json,
-        )
+async def _refresh_levels(model_id: str, level_ids: List[int]):
+    try:
+        fetched = await store.STORE.get_levels(model_id, level_ids)
+        for level_id, level in fetched.items():
+            LEVELS.set((model_id, level_id), level)
+    except store.StoreUnavailable as e:
+        # копия останется протухшей, попробуем на следующем запросе
+        logger.info("Can't refresh %s levels %s: %s", model_id, level_ids, e)
+    finally:
+        _REFRESHING.difference_update((model_id, level_id) for level_id in level_ids)
 
-    return None
+
+def _refresh_in_background(model_id: str, level_ids: List[int]):
+    level_ids = [level_id for level_id in level_ids if (model_id, level_id) not in _REFRESHING]
+    if not level_ids:
+        return
+    _REFRESHING.update((model_id, level_id) for level_id in level_ids)
+    task = asyncio.create_task(_refresh_levels(model_id, level_ids))
+    _REFRESH_TASKS.add(task)
+    task.add_done_callback(_REFRESH_TASKS.discard)
+
+
+async def _get_level(level_id: int, model_id: str) -> Optional[bytes]:
+    """
+    Уровень из снимка, кэша или хранилища. Если хранилище недоступно
+    и копии нет даже протухшей, летит store.StoreUnavailable
+    """
+    key = (model_id.upper(), level_id)
+    if snapshot.SNAPSHOT is not None:
+        level = snapshot.SNAPSHOT.get(*key)
+        if level is not None:
+            return level
+
+    level, fresh = LEVELS.get_stale(key)
+    if level is not None:
+        if not fresh:
+            _refresh_in_background(*key)
+        return level
+
+    level = await store.STORE.get_level(*key)
+    if level is not None and store.STORE.cacheable:
+        LEVELS.set(key, level)
+    return level
+
+
+async def _get_levels(level_ids: List[int], model_id: str) -> bytes:
+    """
+    Отдает JSON вида GetLevelsResponse: уровни в порядке level_ids,
+    отсутствующие пропускает. Все, чего нет в кэше, забираем из хранилища одним запросом.
+    """
+    model_id = model_id.upper()
+    levels = {}
+    missing = []
+    stale = []
+    for level_id in level_ids:
+        level, fresh = None, True
+        if snapshot.SNAPSHOT is not None:
+            level = snapshot.SNAPSHOT.get(model_id, level_id)
+        if level is None:
+            level, fresh = LEVELS.get_stale((model_id, level_id))
+        if level is not None:
+            levels[level_id] = level
+            if not fresh:
+                stale += [level_id]
+        else:
+            missing += [level_id]
+
+    if stale:
+        _refresh_in_background(model_id, stale)
+
+    if missing:
+        fetched = await store.STORE.get_levels(model_id, missing)
+        levels.update(fetched)
+        if store.STORE.cacheable:
+            for level_id, level in fetched.items():
+                LEVELS.set((model_id, level_id), level)
+
+    return b'{"data":[' + b','.join(
+        levels[level_id] for level_id in level_ids if level_id in levels
+    ) + b']}'
@@ -1,31 +1,124 @@
+import asyncio
+import logging
+from collections import namedtuple
+from typing import Optional
+
 import motor.motor_asyncio as aiomotor
+import orjson
+from pymongo.errors import PyMongoError
 
-from app.db import DBS
+from app import snapshot, store
+from app.db import DBS, ensure_model_indexes
 from app.models import GetModelNamesResponse
+from app.responses import make_etag
+from app.routes.get_level import invalidate_levels
 from app.utils import _get_days
 
-NAMES = None
+logger = logging.getLogger(__name__)
+
+# body - готовый JSON GetModelNamesResponse, etag - его хэш,
+# versions - версия уровней каждой модели (меняется при перегенерации),
+# counts - число уровней каждой модели (level_id идут подряд с нуля)
+Catalog = namedtuple('Catalog', ['body', 'etag', 'model_ids', 'versions', 'counts'])
+
+# Подменяется целиком одним присваиванием, поэтому читатели всегда видят согласованный каталог
+CATALOG: Optional[Catalog] = None
+
+_filter = lambda x: x.startswith("MODEL_")
+
+
+def _invalidate_changed(old: Optional[Catalog], new: Catalog):
+    if old is None:
+        return
+
+    for model_id, version in old.versions.items():
+        if new.versions.get(model_id) != version:
+            logger.info("Levels of %s changed, dropping cached copies", model_id)
+            invalidate_levels(model_id)
+            if snapshot.SNAPSHOT is not None:
+                snapshot.SNAPSHOT.discard(model_id)
+
+
+async def refresh_model_names() -> Catalog:
+    global CATALOG
+    models = await store.STORE.list_models()
+
+    res = []
+    for model_id in sorted(models):
+        if not _filter(model_id):
+            continue
+
+        d_b, d_f = _get_days(model_id)
+        res += [{
+            'model_id': model_id,
+            'name': f"Смотрим на {d_b} дней, угадываем на {d_f} дней",
+            'version': models[model_id]['version'],
+        }]
+
+    body = orjson.dumps(GetModelNamesResponse(data=res).dict())
+    catalog = Catalog(
+        body=body,
+        etag=make_etag(body),
+        model_ids=frozenset(models),
+        versions={model_id: model['version'] for model_id, model in models.items()},
+        counts={model_id: model['count'] for model_id, model in models.items()},
+    )
+    old = CATALOG
+    _invalidate_changed(old, catalog)
+    CATALOG = catalog
+    if old is not None:
+        await _index_changed(old, catalog)
+    return CATALOG
+
+
+async def _index_changed(old: Catalog, new: Catalog):
+    """Новые и перегенерированные модели без индекса по level_id читались бы COLLSCAN'ом"""
+    changed = [model_id for model_id, version in new.versions.items() if old.versions.get(model_id) != version]
+    if not changed or 'mongo' not in DBS:
+        return
+    try:
+        await ensure_model_indexes(DBS['mongo'], changed)
+    except PyMongoError as e:
+        logger.warning("Can't create indexes for %s: %s", changed, e)
 
 
-async def _get_model_names() -> GetModelNamesResponse:
-    global NAMES
-    # fast cache
-    if not NAMES:
-        db: aiomotor.AsyncIOMotorDatabase = DBS['mongo']
-        _filter = lambda x: x.startswith("MODEL_")
-        model_list = await db.list_collection_names()
+async def _get_model_names() -> Catalog:
+    # fast cache: пустой каталог тоже считается закэшированным
+    if CATALOG is None:
+        return await refresh_model_names()
+    return CATALOG
 
-        res = []
-        for model_id in model_list:
-            if not _filter(model_id):
-                continue
 
-            d_b, d_f = _get_days(model_id)
-            res += [{
-                'model_id': model_id,
-                'name': f"Смотрим на {d_b} дней, угадываем на {d_f} дней"
-            }]
+async def model_names_refresher(interval: float):
+    """Периодически пересобирает каталог моделей"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_model_names()
+        except (PyMongoError, store.StoreUnavailable) as e:
+            # остается последний удачный каталог
+            logger.warning("Can't refresh model names: %s", e)
 
-        NAMES = GetModelNamesResponse(data=res)
 
-    return NAMES
+async def model_names_watcher():
+    """
+    Пересобирает каталог сразу, как только появляется или удаляется коллекция MODEL_*.
+    Change streams работают только на replica set, иначе остается периодическое обновление.
+    """
+    db: aiomotor.AsyncIOMotorDatabase = DBS['mongo']
+    pipeline = [
+        {'$match': {
+            'operationType': {'$in': ['insert', 'drop', 'rename']},
+            'ns.coll': {'$regex': '^MODEL_'},
+        }},
+        {'$project': {'operationType': 1, 'ns': 1}},
+    ]
+    try:
+        async with db.watch(pipeline) as stream:
+            async for change in stream:
+                if change['operationType'] == 'insert' and CATALOG is not None \
+                        and change['ns']['coll'] in CATALOG.model_ids:
+                    continue
+                await refresh_model_names()
+    except (PyMongoError, store.StoreUnavailable) as e:
+        logger.warning("Model names watcher stopped: %s", e)
@@ -0,0 +1,153 @@
+"""
+Счетчики ответов игроков против моделей: по модели и по уровню.
+Меняются на каждом ответе (см. app.routes.sessions), поэтому запрос
+статистики ничего не пересчитывает по истории ответов.
+В монгу уходят только приращения ($inc) и только за ответы, которые
+записались в ANSWERS: повтор уровня сессией, в том числе через другой
+воркер, не считается. Раз в STATS_REFRESH_INTERVAL секунд каждый воркер
+перечитывает из монги счетчики, изменившиеся с прошлого чтения (поле updated),
+так что при WORKERS > 1 все воркеры отдают общие числа с этой задержкой.
+"""
+from datetime import datetime
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pymongo as pym
+from pymongo.errors import PyMongoError
+
+from app.db import DBS
+
+# model_id -> счетчики, (model_id, level_id) -> счетчики
+MODEL_STATS: Dict[str, Counter] = {}
+LEVEL_STATS: Dict[Tuple[str, int], Counter] = {}
+# приращения, еще не записанные в монгу, в тех же ключах
+PENDING_MODEL_STATS: Dict[str, Counter] = {}
+PENDING_LEVEL_STATS: Dict[Tuple[str, int], Counter] = {}
+# самый поздний updated среди прочитанных счетчиков: дальше читаем только изменившиеся
+_STATS_SEEN_AT: Optional[datetime] = None
+
+COUNTERS = ('answers', 'skips', 'user_correct', 'model_correct')
+
+
+def _answer_counters(answer: Optional[int], target: int, model_predict: int) -> Counter:
+    if answer is None:
+        return Counter(skips=1)
+    return Counter(
+        answers=1,
+        user_correct=int(answer == target),
+        model_correct=int(model_predict == target),
+    )
+
+
+def _add_counters(model_stats: dict, level_stats: dict, model_id: str, level_id: int, counters: Counter):
+    model_stats.setdefault(model_id, Counter()).update(counters)
+    level_stats.setdefault((model_id, level_id), Counter()).update(counters)
+
+
+def _count_answer(model_id: str, level_id: int, answer: Optional[int], target: int, model_predict: int):
+    """Сразу в счетчики воркера; в монгу ответ попадет через _queue_answers, если запишется"""
+    _add_counters(MODEL_STATS, LEVEL_STATS, model_id, level_id, _answer_counters(answer, target, model_predict))
+
+
+def _queue_answers(answers: List[dict]):
+    """Приращения за ответы, записанные в ANSWERS"""
+    for answer in answers:
+        _add_counters(PENDING_MODEL_STATS, PENDING_LEVEL_STATS, answer['model_id'], answer['level_id'],
+                      _answer_counters(answer['answer'], answer['target'], answer['model_predict']))
+
+
+def _format_stats(counters: Optional[Counter]) -> dict:
+    counters = counters or Counter()
+    stats = {name: counters[name] for name in COUNTERS}
+    answers = stats['answers']
+    stats['user_accuracy'] = stats['user_correct'] / answers if answers else None
+    stats['model_accuracy'] = stats['model_correct'] / answers if answers else None
+    return stats
+
+
+def _get_model_stats(model_id: Optional[str] = None, level_id: Optional[int] = None) -> dict:
+    """Статистика всех моделей, одной модели или одного уровня модели"""
+    if model_id is None:
+        return {model_id: _format_stats(counters) for model_id, counters in sorted(MODEL_STATS.items())}
+
+    model_id = model_id.upper()
+    if level_id is None:
+        return {model_id: _format_stats(MODEL_STATS.get(model_id))}
+    return {model_id: {str(level_id): _format_stats(LEVEL_STATS.get((model_id, level_id)))}}
+
+
+def _inc(counters: Counter) -> dict:
+    # updated - время сервера монги, по нему воркеры перечитывают только изменившиеся счетчики
+    return {'$inc': {name: value for name, value in counters.items() if value}, '$currentDate': {'updated': True}}
+
+
+async def flush_stats(db):
+    """Записывает накопленные приращения; при ошибке они возвращаются в очередь"""
+    models, levels = dict(PENDING_MODEL_STATS), dict(PENDING_LEVEL_STATS)
+    PENDING_MODEL_STATS.clear()
+    PENDING_LEVEL_STATS.clear()
+    if not models and not levels:
+        return
+
+    try:
+        if models:
+            await db['MODEL_STATS'].bulk_write([
+                pym.UpdateOne({'_id': model_id}, _inc(counters), upsert=True)
+                for model_id, counters in models.items()
+            ], ordered=False)
+            models = {}
+        if levels:
+            await db['LEVEL_STATS'].bulk_write([
+                pym.UpdateOne({'_id': f"{model_id}:{level_id}"},
+                              {**_inc(counters), '$set': {'model_id': model_id, 'level_id': level_id}},
+                              upsert=True)
+                for (model_id, level_id), counters in levels.items()
+            ], ordered=False)
+    except PyMongoError:
+        for pending, unsaved in ((PENDING_MODEL_STATS, models), (PENDING_LEVEL_STATS, levels)):
+            for key, counters in unsaved.items():
+                pending.setdefault(key, Counter()).update(counters)
+        raise
+
+
+def _doc_counters(doc: dict) -> Counter:
+    return Counter({name: doc.get(name, 0) for name in COUNTERS})
+
+
+async def load_stats(unsaved_answers: Iterable[dict] = (), full: bool = False) -> int:
+    """
+    Счетчики из монги (общие для всех воркеров) плюс то, что еще не записано:
+    приращения в очереди и ответы в буфере (unsaved_answers читается после запросов в монгу).
+    Первый раз и с full=True читаются все счетчики, дальше - только изменившиеся с прошлого чтения
+    """
+    global _STATS_SEEN_AT
+    full = full or _STATS_SEEN_AT is None
+    query = {} if full else {'updated': {'$gte': _STATS_SEEN_AT}}
+    seen_at = _STATS_SEEN_AT
+    db = DBS['mongo']
+    model_stats, level_stats = {}, {}
+    async for doc in db['MODEL_STATS'].find(query):
+        model_stats[doc['_id']] = _doc_counters(doc)
+        seen_at = max(filter(None, (seen_at, doc.get('updated'))), default=None)
+    async for doc in db['LEVEL_STATS'].find(query):
+        level_stats[(doc['model_id'], doc['level_id'])] = _doc_counters(doc)
+        seen_at = max(filter(None, (seen_at, doc.get('updated'))), default=None)
+
+    # дальше без await: ответы, пришедшие во время чтения, уже в буфере
+    unsaved_models, unsaved_levels = {}, {}
+    for answer in unsaved_answers:
+        _add_counters(unsaved_models, unsaved_levels, answer['model_id'], answer['level_id'],
+                      _answer_counters(answer['answer'], answer['target'], answer['model_predict']))
+    for stats, current, pending, unsaved in ((model_stats, MODEL_STATS, PENDING_MODEL_STATS, unsaved_models),
+                                             (level_stats, LEVEL_STATS, PENDING_LEVEL_STATS, unsaved_levels)):
+        for local in (pending, unsaved):
+            for key, counters in local.items():
+                # непрочитанные ключи не трогаем: их счетчики в памяти уже с этими приращениями
+                if full or key in stats:
+                    stats.setdefault(key, Counter()).update(counters)
+        if full:
+            current.clear()
+        current.update(stats)
+
+    _STATS_SEEN_AT = seen_at
+    return len(LEVEL_STATS)
@@ -0,0 +1,45 @@
+import random
+from array import array
+from typing import List, Optional, Sequence
+
+from app.cache import LRUCache
+from app.routes.get_model_names import _get_model_names
+from app.settings.consts import PERMUTATION_CACHE_SIZE
+
+# (model_id, version, count, seed) -> перестановка level_id
+# seed у каждого игрока свой, поэтому перестановки храним компактно: 4 байта на уровень, а не объект int
+PERMUTATIONS = LRUCache(maxsize=PERMUTATION_CACHE_SIZE)
+
+
+def _get_permutation(model_id: str, version: str, count: int, seed: int) -> Sequence[int]:
+    key = (model_id, version, count, seed)
+    permutation = PERMUTATIONS.get(key)
+    if permutation is None:
+        permutation = array('I', range(count))
+        random.Random(f"{model_id}_{version}_{seed}").shuffle(permutation)
+        PERMUTATIONS.set(key, permutation)
+    return permutation
+
+
+async def _get_shuffled_level_ids(model_id: str, seed: int, steps: List[int]) -> List[int]:
+    """
+    level_id для шагов игры в порядке, заданном seed.
+    Шаги за пределами числа уровней пропускаются - уровни закончились.
+    """
+    model_id = model_id.upper()
+    catalog = await _get_model_names()
+    count = catalog.counts.get(model_id, 0)
+    permutation = _get_permutation(model_id, catalog.versions.get(model_id), count, seed)
+    return [permutation[step] for step in steps if 0 <= step < count]
+
+
+async def _get_random_level_id(model_id: str, seed: int = None, step: int = 0) -> Optional[int]:
+    """Без seed - случайный уровень, с seed - уровень шага step в перемешанном порядке"""
+    model_id = model_id.upper()
+    if seed is None:
+        catalog = await _get_model_names()
+        count = catalog.counts.get(model_id, 0)
+        return random.randrange(count) if count else None
+
+    level_ids = await _get_shuffled_level_ids(model_id, seed, [step])
+    return level_ids[0] if level_ids else None
@@ -0,0 +1,50 @@
+import math
+from datetime import date
+from typing import List
+
+from app.db import DBS
+from app.db.queries import TIMESERIES_TABLES, timeseries_query
+from app.metrics import CLICKHOUSE_LATENCY
+
+
+def _get_bucket_days(start_date: date, end_date: date, points: int) -> int:
+    """Сколько дней сворачивать в одну точку, чтобы их было не больше points"""
+    days = (end_date - start_date).days + 1
+    return max(1, math.ceil(days / max(points, 1)))
+
+
+async def _get_timeseries(ticker: str, source: str, start_date: date, end_date: date,
+                          columns: List[str], points: int) -> dict:
+    """
+    Ряды тикера колонками: {'dates': [...], 'data': {колонка: [...]}}.
+    Прореживание и агрегация делаются в ClickHouse, сюда приходит уже points точек.
+    """
+    bucket = _get_bucket_days(start_date, end_date, points)
+    client = DBS['clickhouse']['client']
+
+    with CLICKHOUSE_LATENCY.time(f'timeseries_{source}'):
+        row = await client.fetchrow(timeseries_query(source, columns), params={
+            'ticker': ticker.upper(),
+            'start_date': start_date.isoformat(),
+            'end_date': end_date.isoformat(),
+            'bucket': bucket,
+        })
+
+    return {
+        'ticker': ticker.upper(),
+        'source': source,
+        'bucket_days': bucket,
+        'dates': list(row['dates']),
+        'data': {column: list(row[column]) for column in columns},
+    }
+
+
+def _check_timeseries_request(source: str, columns: List[str]):
+    """Текст ошибки или None. Имена колонок попадают в SQL, поэтому только из списка"""
+    if source not in TIMESERIES_TABLES:
+        return f"Unknown source, expected one of {sorted(TIMESERIES_TABLES)}"
+    _, known = TIMESERIES_TABLES[source]
+    unknown = [column for column in columns if column not in known]
+    if unknown:
+        return f"Unknown columns {unknown} for {source}"
+    return None
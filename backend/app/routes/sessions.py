@@ -0,0 +1,383 @@
+"""
+Игровые сессии: ответы игроков, счет и таблица лидеров.
+
+Общее хранилище сессий - монга, так что при WORKERS > 1 все воркеры видят
+одни и те же сессии: новая сессия сразу пишется в SESSIONS, незнакомый
+session_id ищется там же. Ответы копятся в буфере и раз в
+ANSWERS_FLUSH_INTERVAL секунд пачкой пишутся в ANSWERS с _id
+"сессия:модель:уровень", поэтому один уровень засчитывается сессии один раз
+на все воркеры. Счет сессии пересчитывается по ее ответам в ANSWERS и
+пишется через $max: воркеры не затирают друг другу счет.
+
+В памяти воркера - копии известных ему сессий и таблица лидеров
+(отсортированный список, который правится на каждом ответе). После каждой
+записи копии сверяются с монгой, а верх таблицы (LEADERBOARD_MAX_SIZE сессий)
+перечитывается, так что таблица лидеров общая с задержкой до одного интервала.
+Места дальше верха таблицы считаются по сессиям, известным воркеру.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+import orjson
+import pymongo as pym
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.db import DBS
+from app.routes.get_level import _get_level
+from app.routes.get_model_stats import (
+    _count_answer, _queue_answers, flush_stats, load_stats, PENDING_MODEL_STATS, PENDING_LEVEL_STATS
+)
+from app.settings.consts import ANSWERS_BUFFER_MAX, ANSWERS_BUFFER_LIMIT, ANSWERS_FLUSH_INTERVAL, LEADERBOARD_MAX_SIZE
+
+logger = logging.getLogger(__name__)
+
+# session_id -> {'name', 'user_score', 'model_score', 'answers'}
+SESSIONS: Dict[str, dict] = {}
+# (-user_score, -model_score, session_id) по возрастанию, то есть лучшие первыми
+RANKING: List[tuple] = []
+# session_id -> {(model_id, level_id)}, на которые сессия уже ответила
+ANSWERED: Dict[str, Set[Tuple[str, int]]] = {}
+
+# ответы и сессии, еще не записанные в монгу
+ANSWERS_BUFFER: List[dict] = []
+DIRTY_SESSIONS = set()
+# создается в init_sessions: на python 3.8 asyncio.Lock привязывается к циклу,
+# в котором создан, а при импорте это еще не цикл uvicorn
+_FLUSH_LOCK: Optional[asyncio.Lock] = None
+_FLUSH_INTERVAL = ANSWERS_FLUSH_INTERVAL
+# досрочная запись при переполнении буфера: не больше одной за интервал
+_EARLY_FLUSH: Optional[asyncio.Task] = None
+_EARLY_FLUSH_AT = 0.
+
+
+def init_sessions(flush_interval: float = ANSWERS_FLUSH_INTERVAL):
+    global _FLUSH_LOCK, _FLUSH_INTERVAL
+    _FLUSH_LOCK = asyncio.Lock()
+    _FLUSH_INTERVAL = flush_interval
+
+
+def _log_flush_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Can't flush answers: %s", task.exception())
+
+
+def _schedule_early_flush():
+    """Не ждем таймера, чтобы буфер не рос; пока монга лежит, не долбим ее на каждом ответе"""
+    global _EARLY_FLUSH, _EARLY_FLUSH_AT
+    if _EARLY_FLUSH is not None and not _EARLY_FLUSH.done():
+        return
+    now = time.monotonic()
+    if now - _EARLY_FLUSH_AT < _FLUSH_INTERVAL:
+        return
+    _EARLY_FLUSH_AT = now
+    _EARLY_FLUSH = asyncio.create_task(flush_answers())
+    _EARLY_FLUSH.add_done_callback(_log_flush_error)
+
+
+def _answers_overflow() -> bool:
+    """Буфер ответов полон: монга давно не принимает записи, новые ответы не берем"""
+    return len(ANSWERS_BUFFER) >= ANSWERS_BUFFER_LIMIT
+
+
+def _rank_key(session_id: str, session: dict) -> tuple:
+    return -session['user_score'], -session['model_score'], session_id
+
+
+def _add_session(session_id: str, session: dict):
+    SESSIONS[session_id] = session
+    insort(RANKING, _rank_key(session_id, session))
+
+
+def _session_info(session_id: str) -> dict:
+    session = SESSIONS[session_id]
+    return {
+        'session_id': session_id,
+        'name': session['name'],
+        'user_score': session['user_score'],
+        'model_score': session['model_score'],
+        'answers': session['answers'],
+        'rank': bisect_left(RANKING, _rank_key(session_id, session)) + 1,
+    }
+
+
+async def _create_session(name: Optional[str] = None) -> dict:
+    session_id = uuid.uuid4().hex
+    session = {'name': name, 'user_score': 0, 'model_score': 0, 'answers': 0}
+    _add_session(session_id, session)
+    ANSWERED[session_id] = set()
+    if 'mongo' in DBS:
+        try:
+            # сразу, а не с буфером: следующий запрос может прийти в другой воркер
+            await DBS['mongo']['SESSIONS'].insert_one({'_id': session_id, **session})
+        except PyMongoError as e:
+            logger.warning("Session %s is saved with the next flush: %s", session_id, e)
+            DIRTY_SESSIONS.add(session_id)
+    return _session_info(session_id)
+
+
+async def _load_session(session_id: str) -> bool:
+    """Есть ли сессия; сессию, созданную другим воркером, подтягивает из монги"""
+    if session_id in SESSIONS:
+        return True
+    if 'mongo' not in DBS:
+        return False
+    session = await DBS['mongo']['SESSIONS'].find_one({'_id': session_id})
+    if session is None:
+        return False
+    if session_id not in SESSIONS:
+        session.pop('_id')
+        _add_session(session_id, session)
+    return True
+
+
+async def _get_session(session_id: str) -> Optional[dict]:
+    if not await _load_session(session_id):
+        return None
+    return _session_info(session_id)
+
+
+def _set_score(session_id: str, user_score: int, model_score: int, answers: int):
+    """Меняет счет сессии, переставляя ее в RANKING за O(log n) поиска"""
+    session = SESSIONS[session_id]
+    del RANKING[bisect_left(RANKING, _rank_key(session_id, session))]
+    session.update(user_score=user_score, model_score=model_score, answers=answers)
+    insort(RANKING, _rank_key(session_id, session))
+
+
+def _score(session_id: str, user_point: int, model_point: int):
+    session = SESSIONS[session_id]
+    _set_score(session_id, session['user_score'] + user_point, session['model_score'] + model_point,
+               session['answers'] + 1)
+
+
+async def _answered_levels(session_id: str) -> Set[Tuple[str, int]]:
+    """Уровни, на которые сессия уже ответила; для сессий, поднятых из монги, читаются из ANSWERS"""
+    if session_id not in ANSWERED:
+        answered = set()
+        if 'mongo' in DBS:
+            async for doc in DBS['mongo']['ANSWERS'].find({'session_id': session_id}, {'model_id': 1, 'level_id': 1}):
+                answered.add((doc['model_id'], doc['level_id']))
+        # пока шел запрос, параллельный ответ мог уже завести множество
+        ANSWERED.setdefault(session_id, set()).update(answered)
+    return ANSWERED[session_id]
+
+
+async def _record_answer(session_id: str, model_id: str, level_id: int, answer: Optional[int]) -> Optional[dict]:
+    """
+    Засчитывает ответ (answer=None - пропуск уровня) и возвращает новый счет сессии.
+    Правильный ответ и прогноз модели берутся из самого уровня, клиенту не доверяем.
+    Засчитывается только первый ответ сессии на уровень, повтор возвращает счет без изменений.
+    """
+    if not await _load_session(session_id):
+        return None
+    model_id = model_id.upper()
+    answered = await _answered_levels(session_id)
+    if (model_id, level_id) in answered:
+        return _session_info(session_id)
+
+    # занимаем уровень до await, чтобы параллельный повтор его не засчитал
+    answered.add((model_id, level_id))
+    try:
+        level = await _get_level(level_id=level_id, model_id=model_id)
+    except Exception:
+        answered.discard((model_id, level_id))
+        raise
+    if level is None:
+        answered.discard((model_id, level_id))
+        return None
+
+    level = orjson.loads(level)
+    target, model_predict = level['target'], level['model_predict']
+    user_point = int(answer is not None and answer == target)
+    model_point = int(answer is not None and model_predict == target)
+    _score(session_id, user_point, model_point)
+    _count_answer(model_id, level_id, answer, target, model_predict)
+
+    ANSWERS_BUFFER.append({
+        # один ответ сессии на уровень, сколько бы воркеров его ни приняли
+        '_id': f"{session_id}:{model_id}:{level_id}",
+        # отличает свою запись от записи другого воркера при ошибке дубликата
+        'nonce': uuid.uuid4().hex,
+        'session_id': session_id,
+        'model_id': model_id,
+        'level_id': level_id,
+        'answer': answer,
+        'target': target,
+        'model_predict': model_predict,
+        'user_point': user_point,
+        'model_point': model_point,
+        'ts': time.time(),
+    })
+    if len(ANSWERS_BUFFER) >= ANSWERS_BUFFER_MAX:
+        _schedule_early_flush()
+
+    return _session_info(session_id)
+
+
+def _get_leaderboard(limit: int) -> List[dict]:
+    return [_session_info(session_id) for _, _, session_id in RANKING[:limit]]
+
+
+async def _insert_answers(db, answers: List[dict]) -> List[dict]:
+    """Пишет ответы; возвращает те, что раньше успел записать другой воркер"""
+    try:
+        await db['ANSWERS'].insert_many(answers, ordered=False)
+        return []
+    except BulkWriteError as e:
+        if e.details.get('writeConcernErrors') or any(
+                error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+        duplicates = [answers[error['index']] for error in e.details['writeErrors']]
+
+    # дубликат с нашим nonce - наша же запись из прошлой неудачной попытки
+    nonces = {}
+    async for doc in db['ANSWERS'].find({'_id': {'$in': [answer['_id'] for answer in duplicates]}}, {'nonce': 1}):
+        nonces[doc['_id']] = doc.get('nonce')
+    return [answer for answer in duplicates if nonces.get(answer['_id']) != answer['nonce']]
+
+
+def _buffered_scores(session_ids) -> Dict[str, Counter]:
+    """Очки из ответов, которые еще ждут записи"""
+    scores = {session_id: Counter() for session_id in session_ids}
+    for answer in ANSWERS_BUFFER:
+        if answer['session_id'] in scores:
+            scores[answer['session_id']].update(
+                user_score=answer['user_point'], model_score=answer['model_point'], answers=1)
+    return scores
+
+
+async def _save_scores(db, session_ids: List[str]) -> Dict[str, dict]:
+    """
+    Пересчитывает счета сессий по ANSWERS и пишет их в SESSIONS, возвращает сохраненные счета.
+    $max, а не $set: воркер с более старым пересчетом не затрет более новый
+    """
+    scores = {session_id: {'user_score': 0, 'model_score': 0, 'answers': 0} for session_id in session_ids}
+    async for doc in db['ANSWERS'].aggregate([
+        {'$match': {'session_id': {'$in': session_ids}}},
+        {'$group': {'_id': '$session_id', 'user_score': {'$sum': '$user_point'},
+                    'model_score': {'$sum': '$model_point'}, 'answers': {'$sum': 1}}},
+    ]):
+        scores[doc.pop('_id')] = doc
+
+    await db['SESSIONS'].bulk_write([
+        pym.UpdateOne({'_id': session_id},
+                      {'$max': score, '$setOnInsert': {'name': SESSIONS.get(session_id, {}).get('name')}},
+                      upsert=True)
+        for session_id, score in scores.items()
+    ], ordered=False)
+    # в монге счет может быть больше пересчитанного: ответы, записанные до _id по уровню, без очков
+    return {session['_id']: session async for session in db['SESSIONS'].find({'_id': {'$in': session_ids}})}
+
+
+def _sync_session(session_id: str, saved: dict, buffered: Counter):
+    """Копия сессии в памяти = счет из монги + ответы, которые еще ждут записи"""
+    if session_id not in SESSIONS:
+        _add_session(session_id, {'name': saved.get('name'), 'user_score': 0, 'model_score': 0, 'answers': 0})
+    _set_score(session_id, saved['user_score'] + buffered['user_score'],
+               saved['model_score'] + buffered['model_score'], saved['answers'] + buffered['answers'])
+
+
+async def _top_sessions(db) -> List[dict]:
+    """Верх таблицы лидеров в монге (сортировку покрывает индекс SESSIONS, см. app.db.indexes)"""
+    return await db['SESSIONS'].find({}).sort(
+        [('user_score', pym.DESCENDING), ('model_score', pym.DESCENDING), ('_id', pym.ASCENDING)]
+    ).limit(LEADERBOARD_MAX_SIZE).to_list(LEADERBOARD_MAX_SIZE)
+
+
+async def _refresh_leaderboard(db):
+    """Верх таблицы лидеров из монги: в нем и сессии, которые играют на других воркерах"""
+    top = await _top_sessions(db)
+    buffered = _buffered_scores([session['_id'] for session in top])
+    for session in top:
+        _sync_session(session['_id'], session, buffered[session['_id']])
+
+
+async def flush_answers() -> int:
+    """Пишет накопленные ответы и счета сессий в монгу одной пачкой, возвращает число ответов"""
+    async with _FLUSH_LOCK:
+        if not ANSWERS_BUFFER and not DIRTY_SESSIONS:
+            return 0
+        if 'mongo' not in DBS:
+            # LEVEL_STORE=snapshot: монги нет, сессии живут только в памяти
+            ANSWERS_BUFFER.clear()
+            DIRTY_SESSIONS.clear()
+            PENDING_MODEL_STATS.clear()
+            PENDING_LEVEL_STATS.clear()
+            return 0
+
+        answers = ANSWERS_BUFFER[:]
+        dirty = list(DIRTY_SESSIONS)
+        del ANSWERS_BUFFER[:len(answers)]
+        DIRTY_SESSIONS.difference_update(dirty)
+        session_ids = list({answer['session_id'] for answer in answers}.union(dirty))
+
+        db = DBS['mongo']
+        try:
+            rejected = await _insert_answers(db, answers) if answers else []
+            scores = await _save_scores(db, session_ids)
+        except PyMongoError:
+            # вернем в буфер и попробуем в следующий раз
+            ANSWERS_BUFFER[:0] = answers
+            DIRTY_SESSIONS.update(dirty)
+            raise
+
+        if rejected:
+            logger.info("%s answers were already recorded by another worker", len(rejected))
+        # ответы уже в монге и повторно не пишутся: статистика за них в очереди до успешной записи
+        rejected_ids = {answer['_id'] for answer in rejected}
+        _queue_answers([answer for answer in answers if answer['_id'] not in rejected_ids])
+        try:
+            await flush_stats(db)
+        except PyMongoError as e:
+            logger.warning("Can't flush model stats: %s", e)
+        # ответы, которые опередил другой воркер, из счета уходят здесь
+        buffered = _buffered_scores(session_ids)
+        for session_id, score in scores.items():
+            _sync_session(session_id, score, buffered[session_id])
+        try:
+            await _refresh_leaderboard(db)
+        except PyMongoError as e:
+            logger.warning("Can't refresh leaderboard: %s", e)
+        return len(answers)
+
+
+async def answers_flusher(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_answers()
+        except PyMongoError as e:
+            logger.warning("Can't flush answers: %s", e)
+
+
+async def stats_refresher(interval: float):
+    """
+    Перечитывает статистику моделей по своему таймеру: и на воркерах, которым не приходят ответы.
+    Под замком записи, чтобы очередь приращений не ушла в монгу между чтением и сложением
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with _FLUSH_LOCK:
+                await load_stats(ANSWERS_BUFFER)
+        except PyMongoError as e:
+            logger.warning("Can't refresh model stats: %s", e)
+
+
+async def load_sessions() -> int:
+    """
+    Поднимает после перезапуска верх таблицы лидеров (LEADERBOARD_MAX_SIZE сессий).
+    Остальные сессии читаются из монги по первому запросу (см. _load_session)
+    """
+    SESSIONS.clear()
+    RANKING.clear()
+    ANSWERED.clear()
+    for session in await _top_sessions(DBS['mongo']):
+        session_id = session.pop('_id')
+        _add_session(session_id, session)
+    return len(SESSIONS)
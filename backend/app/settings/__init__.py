@@ -1,7 +1,52 @@
-from app.db import MongoDB
+import os
+
+from app.db import ClickHouse, MongoDB, MySQL
+from app.settings.consts import (
+    LEVEL_CACHE_SIZE, LEVEL_CACHE_TTL, MODEL_NAMES_REFRESH_INTERVAL, WORKERS,
+    COMPRESSION_MIN_SIZE, GZIP_LEVEL, BROTLI_QUALITY, COMPRESSED_CACHE_SIZE, ANSWERS_FLUSH_INTERVAL,
+    WARMUP_LEVELS, MONGO_QUERY_TIMEOUT, MONGO_CATALOG_TIMEOUT, MONGO_BREAKER_FAILURES, MONGO_BREAKER_RESET,
+    STATS_REFRESH_INTERVAL,
+)
 
 CONFIG = dict()
 
 
+def read_settings():
+    from envparse import env
+    env.read_envfile()
+
+    config = dict()
+    config["level_cache_size"] = env.int("LEVEL_CACHE_SIZE", default=LEVEL_CACHE_SIZE)
+    config["level_cache_ttl"] = env.float("LEVEL_CACHE_TTL", default=LEVEL_CACHE_TTL)
+    config["model_names_refresh_interval"] = env.float(
+        "MODEL_NAMES_REFRESH_INTERVAL", default=MODEL_NAMES_REFRESH_INTERVAL
+    )
+    config["workers"] = env.int("WORKERS", default=WORKERS)
+    # файл снимка уровней, собирается при старте (см. server.run)
+    config["level_snapshot_path"] = env("LEVEL_SNAPSHOT_PATH", default="")
+    # mongo - уровни из MODEL_*, snapshot - только из файла LEVEL_SNAPSHOT_PATH, без монги
+    config["level_store"] = env("LEVEL_STORE", default="mongo")
+    config["compression_min_size"] = env.int("COMPRESSION_MIN_SIZE", default=COMPRESSION_MIN_SIZE)
+    config["gzip_level"] = env.int("GZIP_LEVEL", default=GZIP_LEVEL)
+    config["brotli_quality"] = env.int("BROTLI_QUALITY", default=BROTLI_QUALITY)
+    config["compressed_cache_size"] = env.int("COMPRESSED_CACHE_SIZE", default=COMPRESSED_CACHE_SIZE)
+    config["mongo_query_timeout"] = env.float("MONGO_QUERY_TIMEOUT", default=MONGO_QUERY_TIMEOUT)
+    config["mongo_catalog_timeout"] = env.float("MONGO_CATALOG_TIMEOUT", default=MONGO_CATALOG_TIMEOUT)
+    config["mongo_breaker_failures"] = env.int("MONGO_BREAKER_FAILURES", default=MONGO_BREAKER_FAILURES)
+    config["mongo_breaker_reset"] = env.float("MONGO_BREAKER_RESET", default=MONGO_BREAKER_RESET)
+    config["warmup_levels"] = env.int("WARMUP_LEVELS", default=WARMUP_LEVELS)
+    config["answers_flush_interval"] = env.float("ANSWERS_FLUSH_INTERVAL", default=ANSWERS_FLUSH_INTERVAL)
+    config["stats_refresh_interval"] = env.float("STATS_REFRESH_INTERVAL", default=STATS_REFRESH_INTERVAL)
+
+    return config
+
+
 def load_config():
-    CONFIG["mongo"] = MongoDB.read_settings_async()
+    CONFIG["app"] = read_settings()
+    if CONFIG["app"]["level_store"] == "mongo":
+        CONFIG["mongo"] = MongoDB.read_settings_async()
+        # без CH_URL эндпоинт /get_timeseries/ выключен
+        if os.environ.get("CH_URL"):
+            CONFIG["clickhouse"] = ClickHouse.read_settings_async()
+        if os.environ.get("MYSQL_HOST"):
+            CONFIG["mysql"] = MySQL.read_settings_async()
@@ -9,3 +9,61 @@ VERSION = "2021.01.31"
 SERVICE_NAME = "backend"
 
 MSG_SERVICE_DESCRIPTION = "comptech 2021: stock news"
+
+# Кэш уровней: сколько уровней держим в памяти и сколько секунд
+LEVEL_CACHE_SIZE = 1024
+LEVEL_CACHE_TTL = 3600
+
+# Сколько уровней можно запросить за один вызов /get_levels/
+MAX_LEVELS_BATCH = 50
+
+# Как часто (в секундах) пересобирать каталог моделей
+MODEL_NAMES_REFRESH_INTERVAL = 60
+
+# Число процессов uvicorn; при нескольких воркерах уровни отдаются из общего снимка
+WORKERS = 1
+
+# Cache-Control для GET /levels/: версионированный url не меняется никогда,
+# без версии уровень может быть перегенерирован
+LEVEL_MAX_AGE = 30 * 24 * 3600
+LEVEL_UNVERSIONED_MAX_AGE = 60
+
+# Сжатие ответов: меньше COMPRESSION_MIN_SIZE байт не сжимаем
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# сколько сжатых вариантов ответов держать в памяти
+COMPRESSED_CACHE_SIZE = 2048
+
+# Сколько перестановок уровней (по одной на пару модель/seed) держать в памяти;
+# перестановка - array('I'), при 5000 уровнях это ~20 КБ
+PERMUTATION_CACHE_SIZE = 1024
+
+# Временные ряды из ClickHouse: сколько точек отдавать по умолчанию и максимум
+TIMESERIES_POINTS = 500
+TIMESERIES_MAX_POINTS = 5000
+
+# Ответы игроков пишутся в монгу пачками: раз в столько секунд
+# или раньше, если в буфере набралось ANSWERS_BUFFER_MAX ответов
+ANSWERS_FLUSH_INTERVAL = 5
+ANSWERS_BUFFER_MAX = 1000
+# Если монга недоступна, буфер не растет дальше ANSWERS_BUFFER_LIMIT: новые ответы получают 503
+ANSWERS_BUFFER_LIMIT = 20000
+# Статистика моделей перечитывается из монги раз в столько секунд (только изменившиеся счетчики)
+STATS_REFRESH_INTERVAL = 10
+LEADERBOARD_SIZE = 10
+LEADERBOARD_MAX_SIZE = 100
+
+# Размер пачки курсора при выгрузке всех уровней модели (/export/, снимок)
+EXPORT_BATCH_SIZE = 500
+
+# Прогрев после старта: сколько первых уровней каждой модели загрузить в кэш
+WARMUP_LEVELS = 20
+
+# Запросы уровней в монгу не ждем дольше MONGO_QUERY_TIMEOUT секунд, каталог - MONGO_CATALOG_TIMEOUT.
+# После MONGO_BREAKER_FAILURES ошибок подряд MONGO_BREAKER_RESET секунд в монгу не ходим,
+# отдаем последние известные копии уровней и каталога
+MONGO_QUERY_TIMEOUT = 0.5
+MONGO_CATALOG_TIMEOUT = 5.
+MONGO_BREAKER_FAILURES = 5
+MONGO_BREAKER_RESET = 10.
@@ -1,6 +1,28 @@
+import logging
+
+import orjson
+
+from app.settings.consts import DEBUG, SERVICE_NAME
+
+ACCESS_LOGGER = logging.getLogger(f"{SERVICE_NAME}.access")
+
+
 def init_logging():
-    pass
+    logging.basicConfig(
+        level=logging.DEBUG if DEBUG else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
 
 
-async def format_log_message(request, response, has_body=True):
-    pass
+async def format_log_message(request, response, duration: float, route: str = None) -> str:
+    """Одна строка access-лога в JSON, route - шаблон пути (см. app.metrics.route_path)"""
+    client = request.client.host if request.client else None
+    return orjson.dumps({
+        "method": request.method,
+        "path": request.url.path,
+        "route": route,
+        "status": response.status_code,
+        "duration_ms": round(duration * 1000, 3),
+        "size": response.headers.get("content-length"),
+        "client": client,
+    }).decode()
@@ -0,0 +1,105 @@
+"""
+Снимок всех уровней в одном файле, который воркеры открывают через mmap.
+Страницы файла лежат в page cache один раз на машину, поэтому память
+не растет с числом воркеров.
+
+Формат: 8 байт длины заголовка (little-endian), заголовок в JSON
+{"levels": [[model_id, level_id, offset, length], ...], "models": {model_id: {"version", "count"}}},
+затем JSON уровней подряд. Уровни уже сериализованы в ответ бэкенда, поэтому
+при чтении ничего не декодируется.
+"""
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, Optional, Tuple
+
+import orjson
+
+_HEADER_SIZE = struct.Struct("<Q")
+
+
+class LevelSnapshot:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (header_len,) = _HEADER_SIZE.unpack_from(self._mmap, 0)
+        data_start = _HEADER_SIZE.size + header_len
+        header = orjson.loads(self._mmap[_HEADER_SIZE.size:data_start])
+
+        self._index = {
+            (model_id, level_id): (data_start + offset, length)
+            for model_id, level_id, offset, length in header["levels"]
+        }
+        self.models = header.get("models") or {
+            model_id: {"version": "", "count": 0} for model_id, _ in self._index
+        }
+        if "models" not in header:
+            for model_id, _ in self._index:
+                self.models[model_id]["count"] += 1
+
+    def get(self, model_id: str, level_id: int) -> Optional[bytes]:
+        item = self._index.get((model_id, level_id))
+        if item is None:
+            return None
+        offset, length = item
+        return self._mmap[offset:offset + length]
+
+    def level_ids(self, model_id: str):
+        return sorted(level_id for key_model_id, level_id in self._index if key_model_id == model_id)
+
+    def discard(self, model_id: str) -> None:
+        """Перестаем отдавать уровни модели из снимка, например после перегенерации"""
+        self._index = {key: item for key, item in self._index.items() if key[0] != model_id}
+
+    def close(self) -> None:
+        self._index = {}
+        self._mmap.close()
+
+    def __len__(self):
+        return len(self._index)
+
+
+def write_snapshot(path: str, levels: Iterable[Tuple[str, int, bytes]], models: Dict[str, dict] = None) -> int:
+    """
+    Записывает снимок атомарно (через временный файл), возвращает число уровней
+    """
+    index = []
+    chunks = []
+    offset = 0
+    for model_id, level_id, body in levels:
+        index += [(model_id, level_id, offset, len(body))]
+        chunks += [body]
+        offset += len(body)
+
+    header = {"levels": index}
+    if models is not None:
+        header["models"] = models
+    header = orjson.dumps(header)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER_SIZE.pack(len(header)))
+        f.write(header)
+        for body in chunks:
+            f.write(body)
+    os.replace(tmp_path, path)
+
+    return len(index)
+
+
+SNAPSHOT: Optional[LevelSnapshot] = None
+
+
+def open_snapshot(path: str) -> Optional[LevelSnapshot]:
+    global SNAPSHOT
+    if path and os.path.exists(path):
+        SNAPSHOT = LevelSnapshot(path)
+    return SNAPSHOT
+
+
+def close_snapshot() -> None:
+    global SNAPSHOT
+    if SNAPSHOT is not None:
+        SNAPSHOT.close()
+        SNAPSHOT = None
@@ -0,0 +1,264 @@
+"""
+Хранилища уровней. _get_level, _get_levels и _get_model_names ходят только сюда:
+MongoLevelStore - уровни в коллекциях MODEL_* (по умолчанию),
+SnapshotLevelStore - все уровни из одного файла снимка, монга не нужна.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import motor.motor_asyncio as aiomotor
+import orjson
+from pymongo.errors import PyMongoError
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+
+from app.breaker import CircuitBreaker, CircuitOpenError
+from app.db import DBS
+from app.metrics import STAGE_LATENCY, MONGO_LATENCY, register_collector
+from app.settings.consts import (
+    EXPORT_BATCH_SIZE, MONGO_QUERY_TIMEOUT, MONGO_CATALOG_TIMEOUT, MONGO_BREAKER_FAILURES, MONGO_BREAKER_RESET,
+)
+from app.models import GetLevelMongo, GetLevelResponse
+from app.snapshot import LevelSnapshot, write_snapshot
+from app.utils import _get_days
+
+
+class StoreUnavailable(Exception):
+    """Хранилище не ответило вовремя, вернуло ошибку или закрыто предохранителем"""
+
+
+class LevelStore:
+    # стоит ли держать уровни из этого хранилища в LRU-кэше
+    cacheable = True
+
+    async def get_level(self, model_id: str, level_id: int) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def get_levels(self, model_id: str, level_ids: List[int]) -> Dict[int, bytes]:
+        raise NotImplementedError
+
+    async def list_models(self) -> Dict[str, dict]:
+        """model_id -> {'version': ..., 'count': ...}"""
+        raise NotImplementedError
+
+    def iter_levels(self, model_id: str) -> AsyncIterator[Tuple[int, bytes]]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def _get_date_range(end_date: str, days_back: int):
+    end_date = datetime.strptime(end_date, "%Y-%m-%d")
+    start_date = end_date - timedelta(days=days_back)
+    return {
+        (start_date + timedelta(days=x)).strftime("%Y-%m-%d"): x+1
+        for x in range(0, days_back+1)
+    }
+
+
+def _make_level(level_mongo: dict, model_id: str) -> bytes:
+    """
+    Готовый JSON уровня. Если генератор уже положил в документ
+    сериализованный ответ (поле response), отдаем его без разбора.
+    """
+    response = level_mongo.get('response')
+    if response is not None:
+        return response.encode()
+
+    with STAGE_LATENCY.time('model_parse'):
+        d_b, _ = _get_days(model_id)
+
+        level_mongo = GetLevelMongo.parse_obj(level_mongo)
+        dates = _get_date_range(level_mongo.date, d_b)
+
+        new_news = []
+        for news in level_mongo.news:
+            new_news += [(dates[news[0]], news[1])]
+
+        lvl_json = level_mongo.dict()
+        lvl_json['news'] = new_news
+        level = GetLevelResponse(
+            dates=list(dates.keys()),
+            **lvl_json,
+        )
+
+    with STAGE_LATENCY.time('serialization'):
+        return orjson.dumps(level.dict())
+
+
+# Уровень целиком (сырые поля нужны, если генератор не положил response)
+# и только готовый ответ: сырые поля тогда не читаются с диска и не разбираются из BSON
+FULL_PROJECTION = {'_id': 0}
+RESPONSE_PROJECTION = {'_id': 0, 'level_id': 1, 'response': 1}
+
+
+class MongoLevelStore(LevelStore):
+    def __init__(self, timeout: float = MONGO_QUERY_TIMEOUT, catalog_timeout: float = MONGO_CATALOG_TIMEOUT,
+                 breaker: CircuitBreaker = None, read_preference: str = None):
+        """read_preference - только для чтения уровней, например secondaryPreferred"""
+        self.timeout = timeout
+        self.catalog_timeout = catalog_timeout
+        self.breaker = breaker or CircuitBreaker(MONGO_BREAKER_FAILURES, MONGO_BREAKER_RESET)
+        # model_id -> есть ли в уровнях модели поле response, узнаем по первому прочитанному уровню
+        self._precomputed: Dict[str, bool] = {}
+        self.read_preference = None
+        if read_preference:
+            self.read_preference = make_read_preference(read_pref_mode_from_name(read_preference), None)
+
+    def _projection(self, model_id: str) -> dict:
+        return RESPONSE_PROJECTION if self._precomputed.get(model_id) else FULL_PROJECTION
+
+    def _remember(self, model_id: str, levels_mongo: List[dict]):
+        if levels_mongo:
+            self._precomputed[model_id] = all('response' in level for level in levels_mongo)
+
+    @staticmethod
+    def _collection(model_id: str) -> aiomotor.AsyncIOMotorCollection:
+        """Коллекция с настройками клиента (primary): каталог и версии моделей"""
+        db: aiomotor.AsyncIOMotorDatabase = DBS['mongo']
+        return db.get_collection(model_id)
+
+    def _levels(self, model_id: str) -> aiomotor.AsyncIOMotorCollection:
+        """Коллекция для чтения самих уровней, можно с вторичной реплики"""
+        db: aiomotor.AsyncIOMotorDatabase = DBS['mongo']
+        return db.get_collection(model_id, read_preference=self.read_preference)
+
+    async def _call(self, factory, timeout: float):
+        """Запрос в монгу с таймаутом через предохранитель; любой сбой - StoreUnavailable"""
+        try:
+            return await self.breaker.call(factory, timeout)
+        except (asyncio.TimeoutError, CircuitOpenError, PyMongoError) as e:
+            raise StoreUnavailable(f"{type(e).__name__}: {e}") from e
+
+    async def _find(self, model_id: str, level_ids: List[int], projection: dict) -> List[dict]:
+        cursor = self._levels(model_id).find(
+            {'level_id': {'$in': level_ids}}, projection, batch_size=len(level_ids)
+        )
+        with STAGE_LATENCY.time('db_fetch'), MONGO_LATENCY.time('find'):
+            return await self._call(lambda: cursor.to_list(length=None), self.timeout)
+
+    async def get_level(self, model_id: str, level_id: int) -> Optional[bytes]:
+        projection = self._projection(model_id)
+        with STAGE_LATENCY.time('db_fetch'), MONGO_LATENCY.time('find_one'):
+            level_mongo = await self._call(
+                lambda: self._levels(model_id).find_one({'level_id': level_id}, projection), self.timeout
+            )
+        if level_mongo and 'response' not in level_mongo and projection is RESPONSE_PROJECTION:
+            # уровни перегенерировали без response: дочитываем сырые поля
+            levels_mongo = await self._find(model_id, [level_id], FULL_PROJECTION)
+            level_mongo = levels_mongo[0] if levels_mongo else None
+        self._remember(model_id, [level_mongo] if level_mongo else [])
+        if level_mongo:
+            return _make_level(level_mongo, model_id)
+        return None
+
+    async def get_levels(self, model_id: str, level_ids: List[int]) -> Dict[int, bytes]:
+        projection = self._projection(model_id)
+        levels_mongo = await self._find(model_id, level_ids, projection)
+        if projection is RESPONSE_PROJECTION:
+            missing = [level['level_id'] for level in levels_mongo if 'response' not in level]
+            if missing:
+                levels_mongo = [level for level in levels_mongo if 'response' in level]
+                levels_mongo += await self._find(model_id, missing, FULL_PROJECTION)
+        self._remember(model_id, levels_mongo)
+
+        return {
+            level_mongo['level_id']: _make_level(level_mongo, model_id)
+            for level_mongo in levels_mongo
+        }
+
+    async def _get_version(self, model_id: str) -> str:
+        """
+        Генератор пересоздает коллекцию целиком, поэтому _id первого уровня
+        определяет поколение уровней и не меняется, пока уровни дописываются
+        """
+        with MONGO_LATENCY.time('find_one'):
+            first = await self._collection(model_id).find_one({}, {'_id': 1}, sort=[('_id', 1)])
+        return str(first['_id']) if first else ''
+
+    async def list_models(self) -> Dict[str, dict]:
+        return await self._call(self._list_models, self.catalog_timeout)
+
+    async def _list_models(self) -> Dict[str, dict]:
+        db: aiomotor.AsyncIOMotorDatabase = DBS['mongo']
+        with MONGO_LATENCY.time('list_collection_names'):
+            model_list = await db.list_collection_names()
+
+        models = {}
+        for model_id in sorted(model_list):
+            if not model_id.startswith("MODEL_"):
+                continue
+
+            with MONGO_LATENCY.time('estimated_document_count'):
+                count = await self._collection(model_id).estimated_document_count()
+            models[model_id] = {'version': await self._get_version(model_id), 'count': count}
+        return models
+
+    async def iter_levels(self, model_id: str,
+                          batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[Tuple[int, bytes]]:
+        # по индексу level_id, чтобы выгрузка шла в порядке уровней
+        cursor = self._levels(model_id).find(
+            {}, {'_id': 0}, sort=[('level_id', 1)], batch_size=batch_size
+        )
+        async for level_mongo in cursor:
+            yield level_mongo['level_id'], _make_level(level_mongo, model_id)
+
+
+class SnapshotLevelStore(LevelStore):
+    """Уровни из файла снимка (см. app.snapshot), открытого через mmap"""
+    # уровни и так лежат в памяти, копия в LRU не нужна
+    cacheable = False
+
+    def __init__(self, path: str):
+        self.snapshot = LevelSnapshot(path)
+
+    async def get_level(self, model_id: str, level_id: int) -> Optional[bytes]:
+        return self.snapshot.get(model_id, level_id)
+
+    async def get_levels(self, model_id: str, level_ids: List[int]) -> Dict[int, bytes]:
+        levels = {}
+        for level_id in level_ids:
+            level = self.snapshot.get(model_id, level_id)
+            if level is not None:
+                levels[level_id] = level
+        return levels
+
+    async def list_models(self) -> Dict[str, dict]:
+        return dict(self.snapshot.models)
+
+    async def iter_levels(self, model_id: str) -> AsyncIterator[Tuple[int, bytes]]:
+        for level_id in self.snapshot.level_ids(model_id):
+            yield level_id, self.snapshot.get(model_id, level_id)
+
+    async def close(self):
+        self.snapshot.close()
+
+
+STORE: Optional[LevelStore] = None
+register_collector(lambda: {
+    f"mongo_breaker_{name}": value for name, value in STORE.breaker.stats().items()
+} if isinstance(STORE, MongoLevelStore) else {})
+
+
+def init_store(store: LevelStore) -> LevelStore:
+    global STORE
+    STORE = store
+    return STORE
+
+
+async def close_store():
+    global STORE
+    if STORE is not None:
+        await STORE.close()
+        STORE = None
+
+
+async def export_snapshot(store: LevelStore, path: str) -> int:
+    """Выгружает все уровни хранилища в файл снимка, возвращает число уровней"""
+    models = await store.list_models()
+    levels = []
+    for model_id in models:
+        async for level_id, level in store.iter_levels(model_id):
+            levels += [(model_id, level_id, level)]
+    return write_snapshot(path, levels, models)
@@ -0,0 +1,68 @@
+"""
+Прогрев после старта: каталог моделей, первые уровни каждой модели в LRU
+и соединения пула монги. Пока прогрев не закончился, /ready отвечает 503,
+чтобы балансировщик не отправлял сюда первых пользователей.
+"""
+import asyncio
+import logging
+import time
+
+from pymongo.errors import PyMongoError
+
+from app.db import DBS
+from app.store import StoreUnavailable
+from app.routes.get_level import _get_levels
+from app.routes.get_model_names import _get_model_names
+
+logger = logging.getLogger(__name__)
+
+# ready - прогрев закончен, duration - сколько секунд он занял,
+# errors - что прогреть не удалось (инстанс все равно готов, эти уровни прочитаются по запросу)
+STATE = {"ready": False, "duration": None, "errors": []}
+
+
+async def _prime_pool(connections: int):
+    """Открывает соединения заранее: параллельные ping занимают разные соединения пула"""
+    await asyncio.gather(*[DBS['mongo'].command('ping') for _ in range(connections)])
+
+
+async def _warm_model(model_id: str, count: int):
+    try:
+        await _get_levels(level_ids=list(range(count)), model_id=model_id)
+    except (PyMongoError, StoreUnavailable):
+        raise
+    except Exception as e:
+        # битый уровень или неожиданное имя коллекции не должны держать инстанс неготовым
+        logger.exception("Can't warm up %s", model_id)
+        STATE["errors"].append(f"{model_id}: {type(e).__name__}: {e}")
+
+
+async def warmup(levels_per_model: int, connections: int, retry_interval: float = 1.):
+    STATE.update(ready=False, errors=[])
+    start = time.perf_counter()
+    models = 0
+    while True:
+        try:
+            if 'mongo' in DBS:
+                await _prime_pool(connections)
+            catalog = await _get_model_names()
+            models = len(catalog.model_ids)
+            for model_id in sorted(catalog.model_ids):
+                count = min(levels_per_model, catalog.counts.get(model_id, 0))
+                if count:
+                    await _warm_model(model_id, count)
+            break
+        except (PyMongoError, StoreUnavailable) as e:
+            STATE["errors"].clear()
+            logger.warning("Warmup failed, retrying in %ss: %s", retry_interval, e)
+            await asyncio.sleep(retry_interval)
+        except Exception as e:
+            # повтор не поможет; без прогрева кэш просто наполнится запросами
+            logger.exception("Warmup failed, serving without it")
+            STATE["errors"].append(f"{type(e).__name__}: {e}")
+            break
+
+    STATE["duration"] = time.perf_counter() - start
+    STATE["ready"] = True
+    logger.info("Warmup done in %.3fs: %s models, up to %s levels each, %s errors",
+                STATE["duration"], models, levels_per_model, len(STATE["errors"]))
@@ -1,25 +1,109 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from typing import Optional
+
 import uvicorn
-from fastapi import FastAPI, APIRouter, Request
+from fastapi import FastAPI, APIRouter, Request, Response
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from pymongo.errors import PyMongoError
 
-from app.db import init_databases, shutdown_databases
-from app.models import GetModelNamesResponse, GetLevelRequest, GetLevelResponse
-from app.routes.get_level import _get_level
-from app.routes.get_model_names import _get_model_names
+from app.db import DBS, init_databases, shutdown_databases
+from app.db.queries import TIMESERIES_TABLES
+from app.metrics import metrics_middleware, render_metrics
+from app.models import (
+    GetModelNamesResponse, GetLevelRequest, GetLevelResponse, GetLevelsRequest, GetLevelsResponse,
+    GetRandomLevelRequest, GetTimeseriesRequest, GetTimeseriesResponse,
+    CreateSessionRequest, SessionResponse, PostAnswerRequest, LeaderboardResponse,
+)
+from app.breaker import CircuitBreaker
+from app.compression import init_compression
+from app.responses import make_etag, json_response, not_modified
+from app.routes.export_levels import _export_levels
+from app.routes.get_level import _get_level, _get_levels, init_level_cache, LEVELS
+from app.routes.get_model_names import (
+    _get_model_names, refresh_model_names, model_names_refresher, model_names_watcher
+)
+from app.routes.get_random_level import _get_random_level_id, _get_shuffled_level_ids
+from app.routes.sessions import (
+    _create_session, _get_session, _record_answer, _get_leaderboard, answers_flusher, flush_answers, load_sessions,
+    init_sessions, _answers_overflow, stats_refresher,
+)
+from app.routes.get_model_stats import _get_model_stats, load_stats
+from app.routes.get_timeseries import _get_timeseries, _check_timeseries_request
 from app.settings import load_config, CONFIG
-from app.settings.consts import VERSION, SERVICE_NAME, MSG_SERVICE_DESCRIPTION
+from app.settings.consts import (
+    VERSION, SERVICE_NAME, MSG_SERVICE_DESCRIPTION, MAX_LEVELS_BATCH, LEVEL_MAX_AGE, LEVEL_UNVERSIONED_MAX_AGE,
+    TIMESERIES_MAX_POINTS, LEADERBOARD_SIZE, LEADERBOARD_MAX_SIZE,
+)
 from app.settings.logging import init_logging
+from app.snapshot import open_snapshot, close_snapshot
+from app.store import (
+    MongoLevelStore, SnapshotLevelStore, StoreUnavailable, init_store, close_store, export_snapshot
+)
+from app.warmup import STATE as WARMUP, warmup
 
 router = APIRouter()
 
+# фоновые задачи, живущие все время работы сервиса
+TASKS = []
+
 
 @router.on_event("startup")
 async def startup():
+    init_level_cache(CONFIG["app"])
+    init_compression(CONFIG["app"])
+    init_sessions(CONFIG["app"]["answers_flush_interval"])
+
+    if CONFIG["app"]["level_store"] == "snapshot":
+        # все уровни в файле снимка, монга не нужна
+        init_store(SnapshotLevelStore(CONFIG["app"]["level_snapshot_path"]))
+        await refresh_model_names()
+        TASKS.append(asyncio.create_task(warmup(CONFIG["app"]["warmup_levels"], connections=0)))
+        return
+
+    open_snapshot(CONFIG["app"]["level_snapshot_path"])
     await init_databases(CONFIG)
+    init_store(MongoLevelStore(
+        timeout=CONFIG["app"]["mongo_query_timeout"],
+        catalog_timeout=CONFIG["app"]["mongo_catalog_timeout"],
+        breaker=CircuitBreaker(CONFIG["app"]["mongo_breaker_failures"], CONFIG["app"]["mongo_breaker_reset"]),
+        read_preference=CONFIG["mongo"]["levels_read_preference"],
+    ))
+
+    await refresh_model_names()
+    await load_sessions()
+    await load_stats(full=True)
+    TASKS.append(asyncio.create_task(
+        model_names_refresher(CONFIG["app"]["model_names_refresh_interval"])
+    ))
+    TASKS.append(asyncio.create_task(model_names_watcher()))
+    TASKS.append(asyncio.create_task(answers_flusher(CONFIG["app"]["answers_flush_interval"])))
+    TASKS.append(asyncio.create_task(stats_refresher(CONFIG["app"]["stats_refresh_interval"])))
+    # прогрев в фоне: /self_check отвечает сразу, /ready - когда кэш и пул готовы
+    TASKS.append(asyncio.create_task(
+        warmup(CONFIG["app"]["warmup_levels"], connections=CONFIG["mongo"]["client"]["minPoolSize"])
+    ))
 
 
 @router.on_event("shutdown")
 async def shutdown():
-    await shutdown_databases()
+    for task in TASKS:
+        task.cancel()
+    await asyncio.gather(*TASKS, return_exceptions=True)
+    TASKS.clear()
+
+    await close_store()
+    if CONFIG["app"]["level_store"] == "mongo":
+        # последние ответы, не дождавшиеся таймера
+        try:
+            await flush_answers()
+        except PyMongoError as e:
+            logging.getLogger(__name__).warning("Answers are lost on shutdown: %s", e)
+        await shutdown_databases()
+    close_snapshot()
 
 
 @router.get("/self_check")
@@ -27,8 +111,40 @@ async def self_check(r: Request):
     return {"status": "Ok"}
 
 
+@router.get("/ready")
+async def ready():
+    """
+    Проба готовности: 503, пока идет прогрев (каталог, первые уровни моделей, пул монги).
+    Если часть прогрева упала не из-за монги, инстанс готов со status Degraded и warmup_errors.
+    /self_check - проба живости, отвечает сразу после старта процесса.
+    """
+    if not WARMUP["ready"]:
+        return ORJSONResponse({"status": "Warming up"}, status_code=503)
+    if WARMUP["errors"]:
+        # прогрев не удался целиком, но отвечать инстанс может
+        return {"status": "Degraded", "warmup_duration": WARMUP["duration"], "warmup_errors": WARMUP["errors"]}
+    return {"status": "Ok", "warmup_duration": WARMUP["duration"]}
+
+
+@router.get("/cache_stats/")
+async def cache_stats():
+    """
+    Счетчики попаданий/промахов кэша уровней, чтобы подобрать его размер
+    """
+    return {"levels": LEVELS.stats()}
+
+
+@router.get("/metrics")
+async def metrics():
+    """
+    Метрики в формате Prometheus: время запросов по маршрутам, запросы в обработке,
+    время этапов (db_fetch, model_parse, serialization) и запросов в монгу
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @router.get("/get_model_names/")
-async def get_model_names() -> GetModelNamesResponse:
+async def get_model_names(r: Request) -> GetModelNamesResponse:
     """
     идем в монгу и просим коллекции вида: "MODEL_{days_back}_{days_forward}"
     Отдаем json вида:
@@ -37,20 +153,201 @@ async def get_model_names() -> GetModelNamesResponse:
             { 'name': 'string', 'id': 'mongo_collection_name' }
         ]
     }
+    Каталог обновляется в фоне, клиент с If-None-Match получает 304
     """
-    response = await _get_model_names()
-    return response
+    catalog = await _get_model_names()
+    headers = {'Cache-Control': 'no-cache'}
+    cached = not_modified(r, catalog.body, catalog.etag, headers)
+    if cached is not None:
+        return cached
+    return json_response(r, catalog.body, headers=headers, etag=catalog.etag)
 
 
 @router.post("/get_level/")
-async def get_level(r: GetLevelRequest) -> GetLevelResponse:
+async def get_level(r: GetLevelRequest, request: Request) -> GetLevelResponse:
     """
     идем в монгу и просим уровень коллекции вида: "MODEL_{days_back}_{days_forward}"
     """
     response = await _get_level(level_id=r.level_id, model_id=r.model_id)
     if response is None:
         return { 'status': "No level" }
-    return response
+    return json_response(request, response)
+
+
+@router.get("/levels/{model_id}/{level_id}")
+async def get_level_cacheable(model_id: str, level_id: int, r: Request, v: str = None):
+    """
+    То же, что /get_level/, но GET, чтобы ответ мог закэшировать nginx.
+    v - версия уровней модели из /get_model_names/, входит в ключ кэша:
+    после перегенерации меняется версия, а с ней и url.
+    """
+    response = await _get_level(level_id=level_id, model_id=model_id)
+    if response is None:
+        return ORJSONResponse({'status': "No level"}, status_code=404)
+
+    catalog = await _get_model_names()
+    version = catalog.versions.get(model_id.upper())
+    if v is None:
+        cache_control = f"public, max-age={LEVEL_UNVERSIONED_MAX_AGE}"
+    elif v == version:
+        cache_control = f"public, max-age={LEVEL_MAX_AGE}, immutable"
+    else:
+        # устаревшая или еще неизвестная версия: не даем закэшировать под этим ключом
+        cache_control = "no-store"
+
+    headers = {'Cache-Control': cache_control}
+    etag = make_etag(response)
+    cached = not_modified(r, response, etag, headers)
+    if cached is not None:
+        return cached
+    return json_response(r, response, headers=headers, etag=etag)
+
+
+@router.post("/get_levels/")
+async def get_levels(r: GetLevelsRequest, request: Request) -> GetLevelsResponse:
+    """
+    Несколько уровней за один запрос: либо список level_ids, либо диапазон [start, stop)
+    """
+    if r.level_ids is not None:
+        # длину списка ограничивает сама модель запроса
+        level_ids = r.level_ids
+    elif r.start is not None and r.stop is not None:
+        # размер проверяем до range: иначе stop=10**12 съест всю память
+        if r.stop < r.start:
+            return ORJSONResponse({'status': "stop is less than start"}, status_code=400)
+        if r.stop - r.start > MAX_LEVELS_BATCH:
+            return ORJSONResponse({'status': f"Too many levels, max {MAX_LEVELS_BATCH}"}, status_code=400)
+        level_ids = list(range(r.start, r.stop))
+    else:
+        return ORJSONResponse({'status': "No levels requested"}, status_code=400)
+
+    if r.seed is not None:
+        level_ids = await _get_shuffled_level_ids(r.model_id, r.seed, level_ids)
+
+    response = await _get_levels(level_ids=level_ids, model_id=r.model_id)
+    return json_response(request, response)
+
+
+@router.post("/get_random_level/")
+async def get_random_level(r: GetRandomLevelRequest, request: Request) -> GetLevelResponse:
+    """
+    Уровень без похода в монгу за count/$sample: число уровней берется из каталога,
+    перестановки для seed кэшируются в памяти
+    """
+    level_id = await _get_random_level_id(r.model_id, seed=r.seed, step=r.step)
+    response = None
+    if level_id is not None:
+        response = await _get_level(level_id=level_id, model_id=r.model_id)
+    if response is None:
+        return { 'status': "No level" }
+    return json_response(request, response)
+
+
+def _sessions_unavailable() -> Optional[Response]:
+    """
+    Без монги сессии живут в памяти воркера, и при WORKERS > 1
+    следующий запрос игрока может попасть в воркер, который о сессии не знает
+    """
+    if CONFIG["app"]["level_store"] == "snapshot" and CONFIG["app"]["workers"] > 1:
+        return ORJSONResponse({'status': "Sessions need MongoDB when WORKERS > 1"}, status_code=503)
+    return None
+
+
+@router.post("/sessions/")
+async def create_session(r: CreateSessionRequest) -> SessionResponse:
+    """Новая игровая сессия, session_id передается во все ответы"""
+    return _sessions_unavailable() or await _create_session(r.name)
+
+
+@router.get("/sessions/{session_id}")
+async def get_session(session_id: str) -> SessionResponse:
+    """Счет и место сессии; answers - сколько уровней уже пройдено, с него продолжаем после перезагрузки"""
+    unavailable = _sessions_unavailable()
+    if unavailable:
+        return unavailable
+    session = await _get_session(session_id)
+    if session is None:
+        return ORJSONResponse({'status': "No session"}, status_code=404)
+    return session
+
+
+@router.post("/answers/")
+async def post_answer(r: PostAnswerRequest) -> SessionResponse:
+    """
+    Ответ игрока на уровень. Счет считается на сервере, в монгу ответ
+    попадает пачкой вместе с другими (см. app.routes.sessions)
+    """
+    unavailable = _sessions_unavailable()
+    if unavailable:
+        return unavailable
+    if _answers_overflow():
+        return ORJSONResponse({'status': "Too many unsaved answers"}, status_code=503, headers={'Retry-After': '5'})
+    session = await _record_answer(r.session_id, r.model_id, r.level_id, r.answer)
+    if session is None:
+        return {'status': "No session or level"}
+    return session
+
+
+@router.get("/leaderboard/")
+async def get_leaderboard(limit: int = LEADERBOARD_SIZE) -> LeaderboardResponse:
+    """Лучшие сессии по счету игрока, таблица поддерживается отсортированной и не пересчитывается"""
+    unavailable = _sessions_unavailable()
+    if unavailable:
+        return unavailable
+    return {'data': _get_leaderboard(max(0, min(limit, LEADERBOARD_MAX_SIZE)))}
+
+
+@router.get("/export/{model_id}")
+async def export_levels(model_id: str):
+    """
+    Все уровни модели потоком, по уровню в строке (application/x-ndjson), по возрастанию level_id.
+    Список целиком в памяти не собирается:
+        curl -s https://stock-news.site/backend/export/MODEL_30_5 > MODEL_30_5.ndjson
+    """
+    model_id = model_id.upper()
+    catalog = await _get_model_names()
+    if model_id not in catalog.model_ids:
+        return ORJSONResponse({'status': "No model"}, status_code=404)
+
+    headers = {'X-Model-Version': catalog.versions.get(model_id, '')}
+    return StreamingResponse(_export_levels(model_id), media_type="application/x-ndjson", headers=headers)
+
+
+@router.get("/get_model_stats/")
+async def get_model_stats(model_id: str = None, level_id: int = None):
+    """
+    Сколько раз игроки и модель угадали направление: по всем моделям, по одной модели
+    или по одному ее уровню (model_id и level_id). Счетчики обновляются на каждом ответе
+    в /answers/, поэтому запрос ничего не пересчитывает.
+    {'MODEL_30_5': {'answers', 'skips', 'user_correct', 'model_correct', 'user_accuracy', 'model_accuracy'}}
+    """
+    return {'data': _get_model_stats(model_id, level_id)}
+
+
+@router.post("/get_timeseries/")
+async def get_timeseries(r: GetTimeseriesRequest) -> GetTimeseriesResponse:
+    """
+    Дневные ряды тикера из ClickHouse за период, колонками:
+    {'ticker', 'source', 'bucket_days', 'dates': [...], 'data': {колонка: [...]}}.
+    Если дней больше points, соседние дни сворачиваются в одну точку (bucket_days дней на точку).
+    """
+    if "clickhouse" not in DBS:
+        return {'status': "Timeseries are not configured"}
+
+    columns = r.columns or TIMESERIES_TABLES.get(r.source, (None, []))[1]
+    error = _check_timeseries_request(r.source, columns)
+    if error:
+        return {'status': error}
+    if r.end_date < r.start_date or not 0 < r.points <= TIMESERIES_MAX_POINTS:
+        return {'status': f"Bad range, points must be in 1..{TIMESERIES_MAX_POINTS}"}
+
+    return await _get_timeseries(r.ticker, r.source, r.start_date, r.end_date, columns, r.points)
+
+
+async def store_unavailable(request: Request, exc: StoreUnavailable):
+    """Монга не ответила вовремя, а устаревшей копии нет"""
+    logging.getLogger(__name__).warning("Store unavailable on %s: %s", request.url.path, exc)
+    return ORJSONResponse({'status': "Storage unavailable"}, status_code=503, headers={'Retry-After': '1'})
 
 
 def init_app():
@@ -59,17 +356,67 @@ def init_app():
 
     app = FastAPI(
         title=SERVICE_NAME, description=MSG_SERVICE_DESCRIPTION, version=VERSION,
+        default_response_class=ORJSONResponse,
     )
 
+    app.middleware("http")(metrics_middleware)
+    app.add_exception_handler(StoreUnavailable, store_unavailable)
     app.include_router(router, prefix=f"/{SERVICE_NAME}")
 
     return app
 
 
+def build_level_snapshot(path: str) -> int:
+    """Выгружает все уровни из монги в файл снимка, который потом открывают воркеры"""
+    async def _build():
+        await init_databases(CONFIG)
+        try:
+            return await export_snapshot(MongoLevelStore(), path)
+        finally:
+            await shutdown_databases()
+
+    return asyncio.run(_build())
+
+
 def run():
     app = init_app()
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    workers = CONFIG["app"]["workers"]
+
+    # уровни уже в готовом снимке, собирать нечего
+    if CONFIG["app"]["level_store"] == "snapshot":
+        if workers > 1:
+            uvicorn.run("server:init_app", factory=True, host="0.0.0.0", port=8080, workers=workers)
+        else:
+            uvicorn.run(app, host="0.0.0.0", port=8080)
+        return
+
+    snapshot_path = CONFIG["app"]["level_snapshot_path"]
+    if workers > 1 and not snapshot_path:
+        snapshot_path = os.path.join(tempfile.gettempdir(), f"{SERVICE_NAME}_levels.snapshot")
+
+    if snapshot_path:
+        try:
+            count = build_level_snapshot(snapshot_path)
+            logging.getLogger(__name__).info("Level snapshot %s: %s levels", snapshot_path, count)
+            # воркеры читают настройки заново, путь передаем через окружение
+            os.environ["LEVEL_SNAPSHOT_PATH"] = snapshot_path
+            CONFIG["app"]["level_snapshot_path"] = snapshot_path
+        except Exception as e:
+            logging.getLogger(__name__).warning("Can't build level snapshot, serving from MongoDB: %s", e)
+            os.environ["LEVEL_SNAPSHOT_PATH"] = ""
+            CONFIG["app"]["level_snapshot_path"] = ""
+
+    if workers > 1:
+        uvicorn.run("server:init_app", factory=True, host="0.0.0.0", port=8080, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8080)
 
 
 if __name__ == "__main__":
-    run()
+    # python server.py export-snapshot levels.snapshot - выгрузить уровни из монги для LEVEL_STORE=snapshot
+    if len(sys.argv) == 3 and sys.argv[1] == "export-snapshot":
+        load_config()
+        init_logging()
+        print(build_level_snapshot(sys.argv[2]), "levels exported to", sys.argv[2])
+    else:
+        run()
@@ -0,0 +1,5 @@
+import os
+
+# test_api.py собирает приложение при импорте, а настройки монги обязательны
+os.environ.setdefault("MONGODB_CONNECTION_STRING", "mongodb://localhost:27017")
+os.environ.setdefault("MONGODB_DB", "stock-news-bench")
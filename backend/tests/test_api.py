@@ -1,26 +1,137 @@
+import asyncio
+import json
+
+import pytest
 from fastapi.testclient import TestClient
 
-from app.db import init_databases, shutdown_databases
-from app.settings import CONFIG
 from server import init_app
 
-app = init_app(use_sentry=False)
+app = init_app()
+
 
+def test_self_check():
+    # без with: startup не запускается, база для self_check не нужна
+    client = TestClient(app)
+    response = client.get("/backend/self_check")
 
-@app.on_event("startup")
-async def startup():
-    await init_databases(CONFIG)
+    assert response.status_code == 200
+    print(response.json())
+    assert response.json() == {"status": "Ok"}
 
 
-@app.on_event("shutdown")
-async def shutdown():
-    await shutdown_databases()
+def test_ready_before_warmup():
+    from app.warmup import STATE
 
+    STATE["ready"] = False
+    client = TestClient(app)
+    assert client.get("/backend/ready").status_code == 503
+
+    STATE.update(ready=True, duration=0.5)
+    response = client.get("/backend/ready")
+    assert response.status_code == 200
+    assert response.json()["warmup_duration"] == 0.5
+
+
+def test_get_level():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from utils.bench import seed_levels, setup_app, BENCH_DB
+
+    db = mongomock_motor.AsyncMongoMockClient()[BENCH_DB]
+    asyncio.run(seed_levels(db, levels_per_model=3))
+    asyncio.run(setup_app(db))
+
+    client = TestClient(app)
+    response = client.post("/backend/get_level/", json={"model_id": "MODEL_30_5", "level_id": 1})
+    assert response.status_code == 200
+    assert response.json()["level_id"] == 1
+    assert len(response.json()["dates"]) == 31
+
+    response = client.post("/backend/get_levels/", json={"model_id": "MODEL_30_5", "start": 0, "stop": 5})
+    assert [level["level_id"] for level in response.json()["data"]] == [0, 1, 2]
+
+
+def test_export_levels():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from utils.bench import seed_levels, setup_app, BENCH_DB
+
+    db = mongomock_motor.AsyncMongoMockClient()[BENCH_DB]
+    asyncio.run(seed_levels(db, levels_per_model=3))
+    asyncio.run(setup_app(db))
+
+    client = TestClient(app)
+    response = client.get("/backend/export/MODEL_30_5")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.content.splitlines()
+    assert [json.loads(line)["level_id"] for line in lines] == [0, 1, 2]
+
+    assert client.get("/backend/export/MODEL_1_1").status_code == 404
+
+
+def test_index_after_regeneration():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.routes.get_model_names import refresh_model_names
+    from utils.bench import make_level, seed_levels, setup_app, BENCH_DB
+
+    db = mongomock_motor.AsyncMongoMockClient()[BENCH_DB]
+
+    async def run():
+        await seed_levels(db, levels_per_model=3)
+        await setup_app(db)
+        # генератор пересоздает коллекцию, индекс по level_id пропадает
+        await db["MODEL_30_5"].drop()
+        await db["MODEL_30_5"].insert_many([make_level("MODEL_30_5", i) for i in range(3)])
+        assert len(await db["MODEL_30_5"].index_information()) == 1
+
+        await refresh_model_names()
+        indexes = await db["MODEL_30_5"].index_information()
+        assert any(index["key"] == [("level_id", 1)] and index.get("unique") for index in indexes.values())
+
+    asyncio.run(run())
+
+
+def test_warmup_degraded(monkeypatch):
+    from app import warmup
+    from app.routes.get_model_names import Catalog
+
+    catalog = Catalog(body=b"", etag="", model_ids=frozenset(["MODEL_30_5", "MODEL_x"]), versions={},
+                      counts={"MODEL_30_5": 3, "MODEL_x": 3})
+    warmed = []
+
+    async def get_model_names():
+        return catalog
+
+    async def get_levels(level_ids, model_id):
+        if model_id == "MODEL_x":
+            raise ValueError("invalid literal for int()")
+        warmed.append(model_id)
+
+    monkeypatch.setattr(warmup, "_get_model_names", get_model_names)
+    monkeypatch.setattr(warmup, "_get_levels", get_levels)
+    monkeypatch.delitem(warmup.DBS, "mongo", raising=False)
+    asyncio.run(warmup.warmup(levels_per_model=2, connections=0))
+
+    assert warmed == ["MODEL_30_5"]
+    response = TestClient(app).get("/backend/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "Degraded"
+    assert response.json()["warmup_errors"][0].startswith("MODEL_x: ValueError")
+
+
+def test_get_levels_limits():
+    client = TestClient(app)
+    response = client.post("/backend/get_levels/", json={"model_id": "MODEL_30_5", "start": 0, "stop": 10 ** 12})
+    assert response.status_code == 400 and response.json()["status"].startswith("Too many levels")
+    response = client.post("/backend/get_levels/", json={"model_id": "MODEL_30_5", "start": 5, "stop": 0})
+    assert response.status_code == 400
+    response = client.post("/backend/get_levels/", json={"model_id": "MODEL_30_5", "level_ids": list(range(1000))})
+    assert response.status_code == 422
 
-def test_self_check():
-    with TestClient(app) as client:
-        response = client.get("/stock_news/self_check/")
 
-        assert response.status_code == 200
-        print(response.json())
-        assert response.json() == {"status": "Ok"}
+def test_metrics_route_label():
+    client = TestClient(app)
+    client.get("/backend/self_check")
+    client.get("/backend/no_such_route")
+    metrics = client.get("/backend/metrics").text
+    assert 'route="/backend/self_check",status="200"' in metrics
+    assert 'route="unmatched",status="404"' in metrics
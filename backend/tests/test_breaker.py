@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from app.breaker import CircuitBreaker, CircuitOpenError
+
+
+async def _fail():
+    raise ConnectionError("down")
+
+
+async def _ok():
+    return "ok"
+
+
+async def _slow():
+    await asyncio.sleep(1)
+
+
+def test_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await breaker.call(_fail)
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(_ok)
+        assert breaker.rejected == 1
+
+        await asyncio.sleep(0.06)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert await breaker.call(_ok) == "ok"
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_breaker_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(_slow, timeout=0.01)
+        assert breaker.timeouts == 1
+        assert breaker.state == CircuitBreaker.OPEN
+
+    asyncio.run(scenario())
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await breaker.call(_fail)
+        await asyncio.sleep(0.02)
+        with pytest.raises(ConnectionError):
+            await breaker.call(_fail)
+        assert breaker.state == CircuitBreaker.OPEN
+
+    asyncio.run(scenario())
+
+
+def test_only_probe_clears_probe_flag():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.02)
+
+    async def slow_fail():
+        await asyncio.sleep(0.03)
+        raise ConnectionError("down")
+
+    async def long_probe():
+        await asyncio.sleep(0.2)
+        return "ok"
+
+    async def scenario():
+        # запрос начат, пока предохранитель закрыт
+        started_closed = asyncio.ensure_future(breaker.call(slow_fail))
+        await asyncio.sleep(0)
+        with pytest.raises(ConnectionError):
+            await breaker.call(_fail)
+        await asyncio.sleep(0.025)
+        probe = asyncio.ensure_future(breaker.call(long_probe))
+        await asyncio.sleep(0)
+
+        with pytest.raises(ConnectionError):
+            await started_closed
+        await asyncio.sleep(0.03)
+        # проба еще идет, второй пробный запрос не пропускаем
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(_ok)
+        assert await probe == "ok"
+
+    asyncio.run(scenario())
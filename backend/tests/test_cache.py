@@ -0,0 +1,63 @@
+import time
+
+from app.cache import LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set(('MODEL_30_5', 0), 'a')
+    cache.set(('MODEL_30_5', 1), 'b')
+    assert cache.get(('MODEL_30_5', 0)) == 'a'
+
+    cache.set(('MODEL_30_5', 2), 'c')
+    assert ('MODEL_30_5', 1) not in cache
+    assert cache.get(('MODEL_30_5', 0)) == 'a'
+    assert cache.get(('MODEL_30_5', 2)) == 'c'
+
+
+def test_ttl_expiration():
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.set('key', 'value')
+    assert cache.get('key') == 'value'
+
+    time.sleep(0.02)
+    assert cache.get('key') is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_invalidate_by_model():
+    cache = LRUCache(maxsize=10)
+    cache.set(('MODEL_30_5', 0), 'a')
+    cache.set(('MODEL_60_5', 0), 'b')
+
+    assert cache.invalidate(lambda key: key[0] == 'MODEL_30_5') == 1
+    assert cache.get(('MODEL_30_5', 0)) is None
+    assert cache.get(('MODEL_60_5', 0)) == 'b'
+
+
+def test_stale_copy():
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.set('key', 'value')
+    assert cache.get_stale('key') == ('value', True)
+
+    time.sleep(0.02)
+    assert cache.get('key') is None
+    assert cache.get_stale('key') == ('value', False)
+    assert cache.get_stale('missing') == (None, False)
+    assert cache.stats()['stale_hits'] == 1
+
+
+def test_permutation_is_compact():
+    import random
+    from array import array
+    from app.routes.get_random_level import _get_permutation
+
+    permutation = _get_permutation("MODEL_30_5", "v1", 5000, seed=42)
+    assert isinstance(permutation, array) and permutation.itemsize == 4
+    assert sorted(permutation) == list(range(5000))
+    # порядок тот же, что был у перестановки-списка: у игроков не меняются уровни
+    expected = list(range(5000))
+    random.Random("MODEL_30_5_v1_42").shuffle(expected)
+    assert list(permutation) == expected
+    assert _get_permutation("MODEL_30_5", "v1", 5000, seed=42) is permutation
@@ -0,0 +1,45 @@
+import gzip
+
+from app import compression
+from app.compression import choose_encoding, compress_cached
+
+
+def test_choose_encoding():
+    assert choose_encoding(None) is None
+    assert choose_encoding("identity") is None
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0") is None
+    if compression.brotli is not None:
+        assert choose_encoding("gzip, deflate, br") == "br"
+        assert choose_encoding("br;q=0.5, gzip") == "gzip"
+    else:
+        assert choose_encoding("gzip, deflate, br") == "gzip"
+
+
+def test_compress_cached():
+    body = b'{"prices":[' + b','.join(b'1.5' for _ in range(500)) + b']}'
+    compressed = compress_cached(body, "gzip", '"etag"')
+    assert gzip.decompress(compressed) == body
+    assert compress_cached(body, "gzip", '"etag"') is compressed
+
+
+def test_etag_per_encoding():
+    from starlette.requests import Request
+    from app.responses import json_response, make_etag, not_modified
+
+    def request(accept_encoding, if_none_match=None):
+        headers = [(b"accept-encoding", accept_encoding.encode())]
+        if if_none_match:
+            headers.append((b"if-none-match", if_none_match.encode()))
+        return Request({"type": "http", "headers": headers})
+
+    body = b'{"prices":[' + b','.join(b'1.5' for _ in range(500)) + b']}'
+    etag = make_etag(body)
+    gzipped = json_response(request("gzip"), body, etag=etag).headers["etag"]
+    plain = json_response(request("identity"), body, etag=etag).headers["etag"]
+    assert gzipped == etag[:-1] + '-gzip"' and plain == etag
+
+    # 304 только для того же варианта ответа
+    assert not_modified(request("gzip", gzipped), body, etag).headers["etag"] == gzipped
+    assert not_modified(request("identity", gzipped), body, etag) is None
+    assert not_modified(request("gzip", plain), body, etag) is None
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from app.routes import get_model_stats as stats
+
+
+@pytest.fixture(autouse=True)
+def clean_stats():
+    for state in (stats.MODEL_STATS, stats.LEVEL_STATS, stats.PENDING_MODEL_STATS, stats.PENDING_LEVEL_STATS):
+        state.clear()
+    yield
+
+
+def test_count_answers():
+    stats._count_answer("MODEL_30_5", 1, 1, target=1, model_predict=0)
+    stats._count_answer("MODEL_30_5", 1, 0, target=1, model_predict=1)
+    stats._count_answer("MODEL_30_5", 2, None, target=0, model_predict=0)
+
+    model = stats._get_model_stats("model_30_5")["MODEL_30_5"]
+    assert model["answers"] == 2
+    assert model["skips"] == 1
+    assert model["user_correct"] == 1
+    assert model["model_correct"] == 1
+    assert model["user_accuracy"] == 0.5
+
+    level = stats._get_model_stats("MODEL_30_5", 2)["MODEL_30_5"]["2"]
+    assert level["answers"] == 0
+    assert level["user_accuracy"] is None
+    # в монгу только после записи ответов
+    assert not stats.PENDING_LEVEL_STATS
+
+
+def test_queue_answers():
+    answer = {'model_id': "MODEL_30_5", 'level_id': 1, 'answer': 1, 'target': 1, 'model_predict': 0}
+    stats._queue_answers([answer, dict(answer, level_id=2, answer=None)])
+    assert stats.PENDING_LEVEL_STATS[("MODEL_30_5", 1)]["user_correct"] == 1
+    assert stats.PENDING_MODEL_STATS["MODEL_30_5"] == {'answers': 1, 'user_correct': 1, 'model_correct': 0, 'skips': 1}
+
+
+def test_unknown_model():
+    assert stats._get_model_stats("MODEL_1_1")["MODEL_1_1"]["answers"] == 0
+    assert stats._get_model_stats() == {}
+
+
+def test_load_only_changed_stats(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.db import DBS
+
+    db = mongomock_motor.AsyncMongoMockClient()['stats-refresh-test']
+    monkeypatch.setitem(DBS, 'mongo', db)
+    monkeypatch.setattr(stats, '_STATS_SEEN_AT', None)
+    answer = {'model_id': "MODEL_30_5", 'level_id': 1, 'answer': 1, 'target': 1, 'model_predict': 0}
+
+    async def run():
+        stats._queue_answers([answer, dict(answer, model_id="MODEL_60_10")])
+        await stats.flush_stats(db)
+        assert await stats.load_stats() == 2
+        # другой воркер записал ответ по MODEL_60_10, а этот посчитал у себя ответ по MODEL_30_5
+        await db['MODEL_STATS'].update_one({'_id': "MODEL_60_10"},
+                                           {'$inc': {'answers': 4}, '$currentDate': {'updated': True}})
+        stats._count_answer("MODEL_30_5", 1, 1, target=1, model_predict=0)
+        await stats.load_stats([answer])
+
+    asyncio.run(run())
+    assert stats.MODEL_STATS["MODEL_60_10"]["answers"] == 5
+    # ответ из буфера не потерян и не посчитан дважды
+    assert stats.MODEL_STATS["MODEL_30_5"]["answers"] == 2
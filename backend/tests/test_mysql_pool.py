@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from app.db.wrappers import MySQLPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def ping(self, reconnect):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(MySQLPool):
+    def _connect(self):
+        return FakeConnection()
+
+
+def test_pool_reuses_connections():
+    pool = FakePool({}, minsize=1, maxsize=2, acquire_timeout=0.01)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert pool.stats()["size"] == 1
+
+
+def test_pool_limits_size():
+    pool = FakePool({}, minsize=0, maxsize=2, acquire_timeout=0.01)
+    with pool.connection(), pool.connection():
+        with pytest.raises(TimeoutError):
+            with pool.connection():
+                pass
+    assert pool.stats() == {"size": 2, "freesize": 2, "maxsize": 2, "acquire_timeouts": 1}
+
+
+def test_pool_threads():
+    pool = FakePool({}, minsize=0, maxsize=4, acquire_timeout=1)
+    in_use = set()
+    lock = threading.Lock()
+
+    def work():
+        for _ in range(100):
+            with pool.connection() as connection:
+                with lock:
+                    assert id(connection) not in in_use
+                    in_use.add(id(connection))
+                with lock:
+                    in_use.discard(id(connection))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pool.stats()["size"] <= 4
+
+
+def test_broken_connection_is_dropped():
+    pool = FakePool({}, minsize=1, maxsize=1, acquire_timeout=0.01)
+    with pytest.raises(ValueError):
+        with pool.connection() as connection:
+            raise ValueError
+    assert connection.closed
+    assert pool.stats()["size"] == 0
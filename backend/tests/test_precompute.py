@@ -0,0 +1,54 @@
+import asyncio
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from app.store import MongoLevelStore, _make_level, RESPONSE_PROJECTION
+from utils.bench import make_level
+
+PRECOMPUTE_PATH = Path(__file__).parents[2] / "data_preprocess" / "precompute_levels.py"
+
+
+def _precompute_module():
+    spec = importlib.util.spec_from_file_location("precompute_levels", PRECOMPUTE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_precomputed_level_matches_model():
+    precompute = _precompute_module()
+    level = make_level("MODEL_30_5", 3, precomputed=False)
+    # генератор может положить целые цены
+    level['prices'][0] = 100
+    level['volumes'][0] = 0
+
+    assert precompute.make_level_response(level, "MODEL_30_5").encode() == _make_level(dict(level), "MODEL_30_5")
+
+
+def test_store_reads_only_response(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.db import DBS
+
+    db = mongomock_motor.AsyncMongoMockClient()["precompute-test"]
+    monkeypatch.setitem(DBS, 'mongo', db)
+
+    async def run():
+        await db["MODEL_30_5"].insert_many([make_level("MODEL_30_5", i) for i in range(3)])
+        await db["MODEL_60_10"].insert_many([make_level("MODEL_60_10", i, precomputed=False) for i in range(3)])
+        store = MongoLevelStore()
+
+        first = await store.get_level("MODEL_30_5", 0)
+        assert store._projection("MODEL_30_5") is RESPONSE_PROJECTION
+        assert await store.get_level("MODEL_30_5", 0) == first
+        assert set(await store.get_levels("MODEL_30_5", [0, 1, 5])) == {0, 1}
+
+        # уровни без response по-прежнему собираются из сырых полей
+        await store.get_level("MODEL_60_10", 0)
+        assert store._projection("MODEL_60_10") is not RESPONSE_PROJECTION
+        store._precomputed["MODEL_60_10"] = True
+        assert (await store.get_levels("MODEL_60_10", [1, 2])).keys() == {1, 2}
+        assert store._projection("MODEL_60_10") is not RESPONSE_PROJECTION
+
+    asyncio.run(run())
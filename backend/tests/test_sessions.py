@@ -0,0 +1,203 @@
+import asyncio
+
+import orjson
+import pytest
+
+from app.routes import sessions
+
+
+@pytest.fixture(autouse=True)
+def clean_sessions():
+    for state in (sessions.SESSIONS, sessions.RANKING, sessions.ANSWERED, sessions.ANSWERS_BUFFER,
+                  sessions.DIRTY_SESSIONS):
+        state.clear()
+    yield
+
+
+def test_ranking_follows_scores():
+    first = asyncio.run(sessions._create_session("first"))['session_id']
+    second = asyncio.run(sessions._create_session("second"))['session_id']
+
+    sessions._score(second, 1, 0)
+    assert [s['session_id'] for s in sessions._get_leaderboard(10)] == [second, first]
+    assert asyncio.run(sessions._get_session(second))['rank'] == 1
+
+    sessions._score(first, 1, 1)
+    sessions._score(first, 1, 0)
+    leaderboard = sessions._get_leaderboard(10)
+    assert [s['session_id'] for s in leaderboard] == [first, second]
+    assert leaderboard[0]['user_score'] == 2
+    assert leaderboard[0]['answers'] == 2
+    assert len(sessions.RANKING) == 2
+
+
+def test_leaderboard_limit():
+    for i in range(5):
+        asyncio.run(sessions._create_session(str(i)))
+    assert len(sessions._get_leaderboard(3)) == 3
+    assert asyncio.run(sessions._get_session("missing")) is None
+
+
+def test_repeated_answer_is_ignored(monkeypatch):
+    async def get_level(level_id, model_id):
+        return orjson.dumps({'target': 1, 'model_predict': 0})
+
+    monkeypatch.setattr(sessions, '_get_level', get_level)
+    session_id = asyncio.run(sessions._create_session("player"))['session_id']
+
+    for _ in range(5):
+        session = asyncio.run(sessions._record_answer(session_id, "model_30_5", 0, 1))
+    assert session['user_score'] == 1
+    assert session['answers'] == 1
+    assert len(sessions.ANSWERS_BUFFER) == 1
+
+    session = asyncio.run(sessions._record_answer(session_id, "MODEL_30_5", 1, 1))
+    assert session['user_score'] == 2
+
+
+def test_early_flush_once_per_interval(monkeypatch):
+    async def get_level(level_id, model_id):
+        return orjson.dumps({'target': 1, 'model_predict': 0})
+
+    flushes = []
+
+    async def flush_answers():
+        flushes.append(len(sessions.ANSWERS_BUFFER))
+        raise RuntimeError("mongo is down")
+
+    monkeypatch.setattr(sessions, '_get_level', get_level)
+    monkeypatch.setattr(sessions, 'flush_answers', flush_answers)
+    monkeypatch.setattr(sessions, 'ANSWERS_BUFFER_MAX', 2)
+    monkeypatch.setattr(sessions, 'ANSWERS_BUFFER_LIMIT', 4)
+    monkeypatch.setattr(sessions, '_EARLY_FLUSH_AT', 0.)
+
+    async def play():
+        sessions.init_sessions(flush_interval=60)
+        session_id = (await sessions._create_session())['session_id']
+        for level_id in range(4):
+            await sessions._record_answer(session_id, "MODEL_30_5", level_id, 1)
+            await asyncio.sleep(0)
+
+    asyncio.run(play())
+    # буфер переполнялся трижды, но досрочная запись одна за интервал
+    assert flushes == [2]
+    assert sessions._answers_overflow()
+
+
+def test_sessions_shared_between_workers(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.db import DBS
+
+    async def get_level(level_id, model_id):
+        return orjson.dumps({'target': 1, 'model_predict': 1})
+
+    def restart_worker():
+        for state in (sessions.SESSIONS, sessions.RANKING, sessions.ANSWERED, sessions.ANSWERS_BUFFER):
+            state.clear()
+
+    monkeypatch.setattr(sessions, '_get_level', get_level)
+    monkeypatch.setitem(DBS, 'mongo', mongomock_motor.AsyncMongoMockClient()['sessions-test'])
+
+    async def play():
+        sessions.init_sessions()
+        session_id = (await sessions._create_session("player"))['session_id']
+        await sessions._record_answer(session_id, "MODEL_30_5", 0, 1)
+        worker_a = sessions.ANSWERS_BUFFER[:]
+
+        # другой воркер видит сессию и отвечает на тот же уровень раньше, чем первый записал ответ
+        restart_worker()
+        session = await sessions._record_answer(session_id, "MODEL_30_5", 0, 1)
+        assert session['user_score'] == 1
+        await sessions.flush_answers()
+
+        sessions.ANSWERS_BUFFER[:] = worker_a
+        await sessions.flush_answers()
+        session = await sessions._get_session(session_id)
+        assert (session['user_score'], session['model_score'], session['answers']) == (1, 1, 1)
+
+        # после перезапуска повтор отсекается по ANSWERS
+        restart_worker()
+        session = await sessions._record_answer(session_id, "MODEL_30_5", 0, 1)
+        assert session['answers'] == 1
+        assert not sessions.ANSWERS_BUFFER
+
+    asyncio.run(play())
+
+
+def test_model_stats_count_first_answer(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.db import DBS
+    from app.routes import get_model_stats as stats
+
+    async def get_level(level_id, model_id):
+        return orjson.dumps({'target': 1, 'model_predict': 0})
+
+    monkeypatch.setattr(sessions, '_get_level', get_level)
+    monkeypatch.setitem(DBS, 'mongo', mongomock_motor.AsyncMongoMockClient()['stats-test'])
+    monkeypatch.setattr(stats, '_STATS_SEEN_AT', None)
+    for state in (stats.MODEL_STATS, stats.LEVEL_STATS, stats.PENDING_MODEL_STATS, stats.PENDING_LEVEL_STATS):
+        state.clear()
+
+    async def play():
+        sessions.init_sessions()
+        session_id = (await sessions._create_session())['session_id']
+        for _ in range(3):
+            await sessions._record_answer(session_id, "MODEL_30_5", 0, 1)
+        # тот же уровень через другой воркер, пока первый не записал ответ
+        worker_a = sessions.ANSWERS_BUFFER[:]
+        sessions.ANSWERED.clear()
+        sessions.ANSWERS_BUFFER.clear()
+        await sessions._record_answer(session_id, "MODEL_30_5", 0, 1)
+        await sessions.flush_answers()
+        sessions.ANSWERS_BUFFER[:] = worker_a
+        await sessions.flush_answers()
+        # то, что делает stats_refresher по таймеру
+        await stats.load_stats(sessions.ANSWERS_BUFFER)
+
+    asyncio.run(play())
+    assert stats._get_model_stats("MODEL_30_5")["MODEL_30_5"]["answers"] == 1
+    assert stats._get_model_stats("MODEL_30_5", 0)["MODEL_30_5"]["0"]["user_correct"] == 1
+
+
+def test_indexes_on_fresh_db():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.db import ensure_indexes
+
+    db = mongomock_motor.AsyncMongoMockClient()["fresh-indexes-test"]
+
+    async def run():
+        await ensure_indexes(db)
+        answers = await db['ANSWERS'].index_information()
+        leaderboard = await db['SESSIONS'].index_information()
+        return answers, leaderboard
+
+    answers, leaderboard = asyncio.run(run())
+    assert any(index['key'] == [('session_id', 1)] for index in answers.values())
+    # индекс покрывает всю сортировку таблицы лидеров, включая _id
+    assert any(index['key'] == [('user_score', -1), ('model_score', -1), ('_id', 1)] for index in leaderboard.values())
+
+
+def test_load_sessions_keeps_only_top(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.db import DBS
+    from app.models import PostAnswerRequest
+
+    db = mongomock_motor.AsyncMongoMockClient()['load-sessions-test']
+    monkeypatch.setitem(DBS, 'mongo', db)
+    monkeypatch.setattr(sessions, 'LEADERBOARD_MAX_SIZE', 2)
+
+    async def run():
+        await db['SESSIONS'].insert_many([
+            {'_id': str(i), 'name': None, 'user_score': i, 'model_score': 0, 'answers': i} for i in range(5)
+        ])
+        assert await sessions.load_sessions() == 2
+        assert set(sessions.SESSIONS) == {'4', '3'}
+        # остальные сессии подтягиваются по запросу
+        assert (await sessions._get_session('0'))['user_score'] == 0
+        assert '0' in sessions.SESSIONS
+
+    asyncio.run(run())
+
+    with pytest.raises(ValueError):
+        PostAnswerRequest(session_id='4', model_id='MODEL_30_5', level_id=0, answer=5)
+    assert PostAnswerRequest(session_id='4', model_id='MODEL_30_5', level_id=0).answer is None
@@ -0,0 +1,22 @@
+from app.snapshot import LevelSnapshot, write_snapshot
+
+
+def test_snapshot_roundtrip(tmp_path):
+    path = str(tmp_path / "levels.snapshot")
+    levels = [
+        ("MODEL_30_5", 0, b'{"level_id":0}'),
+        ("MODEL_30_5", 1, b'{"level_id":1}'),
+        ("MODEL_60_5", 0, '{"company_name":"Яндекс"}'.encode()),
+    ]
+    assert write_snapshot(path, levels) == 3
+
+    snapshot = LevelSnapshot(path)
+    assert len(snapshot) == 3
+    for model_id, level_id, body in levels:
+        assert snapshot.get(model_id, level_id) == body
+    assert snapshot.get("MODEL_30_5", 2) is None
+
+    snapshot.discard("MODEL_30_5")
+    assert snapshot.get("MODEL_30_5", 0) is None
+    assert snapshot.get("MODEL_60_5", 0) == levels[2][2]
+    snapshot.close()
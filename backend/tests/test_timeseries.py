@@ -0,0 +1,26 @@
+from datetime import date
+
+from app.db.queries import timeseries_query
+from app.routes.get_timeseries import _check_timeseries_request, _get_bucket_days
+
+
+def test_bucket_days():
+    assert _get_bucket_days(date(2020, 1, 1), date(2020, 1, 10), 500) == 1
+    assert _get_bucket_days(date(2017, 1, 1), date(2020, 12, 31), 100) == 15
+    assert _get_bucket_days(date(2020, 1, 1), date(2020, 1, 1), 1) == 1
+
+
+def test_timeseries_query():
+    query = timeseries_query("yfinance", ["close", "volume", "high"])
+    assert "FROM yfinance_daily FINAL" in query
+    assert "avg(close) AS point_close" in query
+    assert "sum(volume) AS point_volume" in query
+    assert "max(high) AS point_high" in query
+    assert "groupArray(point_close) AS close" in query
+
+
+def test_check_timeseries_request():
+    assert _check_timeseries_request("yfinance", ["close"]) is None
+    assert _check_timeseries_request("gdelt", ["average_tone_mean"]) is None
+    assert _check_timeseries_request("mongo", []) is not None
+    assert _check_timeseries_request("yfinance", ["close; DROP TABLE x"]) is not None
@@ -0,0 +1,220 @@
+"""
+Нагрузочный бенчмарк бэкенда.
+
+По умолчанию поднимает приложение в том же процессе (ASGI, без сети) поверх
+in-memory монги (mongomock-motor) с синтетическими уровнями MODEL_*,
+гоняет /get_level/, /get_model_names/ и /self_check с заданной конкурентностью
+и печатает JSON с пропускной способностью и p50/p95/p99.
+
+    cd backend
+    python -m utils.bench --requests 2000 --concurrency 32 --output bench.json
+    python -m utils.bench --baseline bench.json          # сравнить с прошлым релизом
+    python -m utils.bench --mongo-url mongodb://localhost:27017   # локальная настоящая монга
+    python -m utils.bench --url http://localhost:8080      # уже запущенный сервер
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+BENCH_DB = "stock-news-bench"
+MODELS = ["MODEL_30_5", "MODEL_60_10", "MODEL_120_30"]
+ENDPOINTS = ["/self_check", "/get_model_names/", "/get_level/"]
+
+# настройки, без которых не загрузится конфиг приложения
+os.environ.setdefault("MONGODB_CONNECTION_STRING", "mongodb://localhost:27017")
+os.environ.setdefault("MONGODB_DB", BENCH_DB)
+
+
+def make_level(model_id: str, level_id: int, precomputed: bool = True) -> dict:
+    """Синтетический уровень в том виде, в котором его кладет генератор"""
+    from app.store import _make_level
+    from app.utils import _get_days
+
+    rnd = random.Random(f"{model_id}_{level_id}")
+    days_back, _ = _get_days(model_id)
+    end_date = datetime(2020, 1, 1) + timedelta(days=level_id)
+    news_days = sorted(rnd.sample(range(days_back + 1), 5))
+
+    level = {
+        'level_id': level_id,
+        'prices': [round(100 + rnd.gauss(0, 5), 2) for _ in range(days_back)],
+        'tones': [round(rnd.uniform(-5, 5), 4) for _ in range(days_back)],
+        'volumes': [round(rnd.uniform(0, 1), 4) for _ in range(days_back)],
+        'news': [
+            ((end_date - timedelta(days=days_back - day)).strftime("%Y-%m-%d"), f"Headline {day} of level {level_id}")
+            for day in news_days
+        ],
+        'model_predict': rnd.randint(0, 1),
+        'target': rnd.randint(0, 1),
+        'date': end_date.strftime("%Y-%m-%d"),
+        'days_back': days_back,
+        'Ticker': 'BENCH',
+        'company_name': 'Benchmark Inc.',
+        'wiki_info': 'Benchmark Inc. is a synthetic company. ' * 40,
+    }
+    if precomputed:
+        level['response'] = _make_level(dict(level), model_id).decode()
+    return level
+
+
+async def seed_levels(db, levels_per_model: int, precomputed: bool = True):
+    for model_id in MODELS:
+        await db[model_id].drop()
+        await db[model_id].insert_many([
+            make_level(model_id, level_id, precomputed) for level_id in range(levels_per_model)
+        ])
+
+
+async def setup_app(db):
+    """То же, что startup приложения, но с уже готовой базой"""
+    from app.compression import init_compression
+    from app.db import DBS
+    from app.routes.get_level import init_level_cache
+    from app.routes.get_model_names import refresh_model_names
+    from app.settings import CONFIG
+    from app.store import MongoLevelStore, init_store
+
+    DBS["mongo"] = db
+    init_store(MongoLevelStore())
+    init_level_cache(CONFIG["app"])
+    init_compression(CONFIG["app"])
+    await refresh_model_names()
+
+
+def make_request(endpoint: str, i: int, levels_per_model: int) -> dict:
+    if endpoint == "/get_level/":
+        return {
+            "method": "POST",
+            "json": {"model_id": MODELS[i % len(MODELS)], "level_id": (i // len(MODELS)) % levels_per_model},
+        }
+    return {"method": "GET"}
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def run_endpoint(client, prefix: str, endpoint: str, requests: int, concurrency: int, levels_per_model: int):
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            request = make_request(endpoint, i, levels_per_model)
+            start = time.perf_counter()
+            response = await client.request(url=f"{prefix}{endpoint}", **request)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    duration = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "concurrency": concurrency,
+        "duration_s": round(duration, 4),
+        "rps": round(requests / duration, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> list:
+    """Список регрессий: p99 или rps хуже базового больше чем на threshold"""
+    regressions = []
+    for endpoint, stats in result["endpoints"].items():
+        base = baseline["endpoints"].get(endpoint)
+        if not base:
+            continue
+        if stats["p99_ms"] > base["p99_ms"] * (1 + threshold):
+            regressions += [f"{endpoint}: p99 {base['p99_ms']} -> {stats['p99_ms']} ms"]
+        if stats["rps"] < base["rps"] * (1 - threshold):
+            regressions += [f"{endpoint}: rps {base['rps']} -> {stats['rps']}"]
+    return regressions
+
+
+async def bench(args) -> dict:
+    import httpx
+
+    from app.settings.consts import SERVICE_NAME, VERSION
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url)
+    else:
+        from server import init_app
+
+        app = init_app()
+        if args.mongo_url:
+            import motor.motor_asyncio as aiomotor
+            db = aiomotor.AsyncIOMotorClient(args.mongo_url)[BENCH_DB]
+        else:
+            from mongomock_motor import AsyncMongoMockClient
+            db = AsyncMongoMockClient()[BENCH_DB]
+
+        await seed_levels(db, args.levels, precomputed=not args.no_precomputed)
+        await setup_app(db)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+    result = {
+        "version": VERSION,
+        "timestamp": datetime.utcnow().isoformat(),
+        "target": args.url or args.mongo_url or "in-process/mongomock",
+        "endpoints": {},
+    }
+    async with client:
+        for endpoint in args.endpoints:
+            # прогрев, чтобы не мерить холодный кэш
+            await run_endpoint(client, f"/{SERVICE_NAME}", endpoint, args.concurrency, args.concurrency, args.levels)
+            result["endpoints"][endpoint] = await run_endpoint(
+                client, f"/{SERVICE_NAME}", endpoint, args.requests, args.concurrency, args.levels
+            )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="stock-news backend benchmark")
+    parser.add_argument("--requests", type=int, default=1000, help="запросов на эндпоинт")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--levels", type=int, default=20, help="синтетических уровней на модель")
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS)
+    parser.add_argument("--no-precomputed", action="store_true", help="уровни без готового поля response")
+    parser.add_argument("--mongo-url", help="локальная монга вместо mongomock")
+    parser.add_argument("--url", help="бенчить уже запущенный сервер")
+    parser.add_argument("--output", help="куда сохранить JSON с результатом")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args))
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for regression in regressions:
+            print("REGRESSION", regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Параллельная загрузка таймлайнов GDELT.
+
+GDELT просит не чаще одного запроса в 5 секунд, поэтому все запросы процесса
+идут через общий token bucket, а не через time.sleep(5) после каждого.
+Запросы выполняются в пуле потоков: пока один ждет ответа, следующий уже
+может занять освободившийся токен. При ошибке запрос повторяется с
+экспоненциальной задержкой со случайным разбросом (jitter).
+
+Пример:
+    fetcher = GdeltFetcher()
+    timelines = fetcher.fetch_timelines(['nvidia', 'geforce'], ['timelinetone', 'timelinevol'],
+                                        start_date='2020-01-01', end_date='2020-12-31')
+    timelines[('nvidia', 'timelinetone')]  # DataFrame или None, если ключевое слово не подошло
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+from envparse import env
+from gdeltdoc import Filters, GdeltDoc
+
+from response_cache import RESPONSE_CACHE, CacheMiss
+
+# Квота GDELT DOC API: один запрос в 5 секунд
+GDELT_REQUESTS_PER_SECOND = 0.2
+GDELT_WORKERS = 4
+GDELT_RETRIES = 4
+GDELT_BACKOFF = 5.
+
+# Ответы GDELT, которые не исправятся повтором
+NON_RETRYABLE_ERRORS = ('too short', 'too common', 'invalid')
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float = 1.):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Один лимит на весь процесс, сколько бы загрузчиков ни было создано
+GDELT_LIMITER = TokenBucket(env.float('GDELT_REQUESTS_PER_SECOND', default=GDELT_REQUESTS_PER_SECOND))
+
+
+def _is_retryable(error: Exception) -> bool:
+    message = str(error).lower()
+    return not any(text in message for text in NON_RETRYABLE_ERRORS)
+
+
+class GdeltFetcher:
+    def __init__(self, limiter: TokenBucket = GDELT_LIMITER, workers: int = GDELT_WORKERS,
+                 retries: int = GDELT_RETRIES, backoff: float = GDELT_BACKOFF):
+        self.limiter = limiter
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        # GdeltDoc держит requests-сессию, у каждого потока своя и переиспользуется
+        self._local = threading.local()
+
+    def _client(self) -> GdeltDoc:
+        if not hasattr(self._local, 'client'):
+            self._local.client = GdeltDoc()
+        return self._local.client
+
+    def timeline(self, timeline: str, keyword: str, start_date: str, end_date: str) -> Optional[pd.DataFrame]:
+        """
+        Один таймлайн из дискового кэша (см. response_cache) или из сети.
+        None, если GDELT отверг ключевое слово, повторы кончились или в офлайн-режиме его нет в кэше
+        """
+        try:
+            return RESPONSE_CACHE.cached(
+                ('gdelt', keyword, timeline, start_date, end_date),
+                lambda: self._fetch(timeline, keyword, start_date, end_date),
+                end_date=end_date,
+            )
+        except CacheMiss as e:
+            print('CACHE MISS!', e)
+            return None
+
+    def _fetch(self, timeline: str, keyword: str, start_date: str, end_date: str) -> Optional[pd.DataFrame]:
+        gd_filter = Filters(start_date=start_date, end_date=end_date, keyword=keyword)
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            try:
+                return self._client().timeline_search(timeline, gd_filter)
+            except Exception as e:
+                if not _is_retryable(e) or attempt == self.retries:
+                    print('GDELT ERROR!', keyword, timeline, e)
+                    return None
+                # full jitter: от 0 до backoff * 2^attempt
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def fetch_timelines(self, keywords: Iterable[str], timelines: Iterable[str], start_date: str,
+                        end_date: str) -> Dict[Tuple[str, str], Optional[pd.DataFrame]]:
+        """Все пары (ключевое слово, таймлайн) параллельно"""
+        jobs = [(keyword, timeline) for keyword in keywords for timeline in timelines]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = pool.map(lambda job: self.timeline(job[1], job[0], start_date, end_date), jobs)
+            return dict(zip(jobs, results))
+
+
+FETCHER = GdeltFetcher()
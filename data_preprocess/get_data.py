@@ -1,6 +1,8 @@
 import pandas as pd
 import yfinance as yf
-from gdeltdoc import Filters, GdeltDoc
+
+from gdelt_fetcher import FETCHER
+from response_cache import RESPONSE_CACHE
 
 
 def get_data_yfinance(quotation: str, start_date: str, end_date: str, interval='1d') -> pd.DataFrame:
@@ -15,10 +17,15 @@ def get_data_yfinance(quotation: str, start_date: str, end_date: str, interval='
         DataFrame формата "Тикет, Время, 6 видов цен"
     """
 
-    df_res = yf.download(tickers=quotation,
-                         start=start_date,
-                         end=end_date,
-                         interval=interval)
+    # история за прошедший период не меняется, поэтому берем ее из дискового кэша
+    df_res = RESPONSE_CACHE.cached(
+        ('yfinance', quotation, interval, start_date, end_date),
+        lambda: yf.download(tickers=quotation,
+                            start=start_date,
+                            end=end_date,
+                            interval=interval),
+        end_date=end_date,
+    )
     df_res.loc[:, 'Ticker'] = quotation
     df_res = df_res.groupby(pd.Grouper(level="Date", freq=interval.upper())).mean()
     # Приводим время к одному виду для слияния
@@ -52,19 +59,14 @@ def get_data_gdelt(quotation: str, keywords: list, start_date: str, end_date: st
     # Тон статей, их количество и их кол-во в отношении ко всем остальным
     match_list = ["timelinetone", "timelinevolraw", "timelinevol"]
     match_dict = dict(zip(match_list, col_names))
+    # Все таймлайны всех ключевых слов качаем параллельно под общим лимитом запросов
+    timelines = FETCHER.fetch_timelines(keywords, match_list, start_date, end_date)
     for ft in keywords:
         try:
-            f = Filters(
-                start_date=start_date,
-                end_date=end_date,
-                keyword=ft
-            )
-
             for timeline in match_list:
-                gd = GdeltDoc()
-                timeline_data = gd.timeline_search(timeline, f)
-                import time
-                time.sleep(5)
+                timeline_data = timelines[(ft, timeline)]
+                if timeline_data is None:
+                    raise ValueError(f'no {timeline} timeline')
                 timeline_data = timeline_data.fillna(0)
                 timeline_data = timeline_data.groupby(pd.Grouper(key="datetime", freq=interval.upper()))
 
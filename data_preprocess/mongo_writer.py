@@ -0,0 +1,65 @@
+"""
+Запись DataFrame в монгу пачками upsert'ов.
+
+Строки не собираются целиком в список словарей (df.to_dict('records')):
+они идут из DataFrame по одной и уходят пачками по CHUNK_SIZE через
+неупорядоченный bulk_write. Ключ строки - (Ticker, дата), на него создается
+уникальный индекс, поэтому повторная загрузка того же периода перезаписывает
+строки, а не дублирует их.
+
+Пример:
+    ensure_indexes(db['YFINANCE'], 'Date')
+    stats = write_frame(db['YFINANCE'], df_yfinance, 'Date')
+    print(format_throughput(stats))
+"""
+import time
+from collections import Counter
+from typing import Iterator, List
+
+import pandas as pd
+import pymongo as pym
+from pymongo.errors import OperationFailure
+
+CHUNK_SIZE = 1000
+
+
+def ensure_indexes(collection, date_col: str) -> None:
+    """Уникальный индекс (Ticker, дата); старые дубликаты не дадут его создать"""
+    try:
+        collection.create_index([('Ticker', pym.ASCENDING), (date_col, pym.ASCENDING)], unique=True)
+    except OperationFailure as e:
+        print('INDEX ERROR!', collection.name, e)
+
+
+def iter_chunks(df: pd.DataFrame, chunk_size: int = CHUNK_SIZE) -> Iterator[List[dict]]:
+    """Строки DataFrame словарями, пачками по chunk_size"""
+    columns = list(df.columns)
+    chunk = []
+    # itertuples отдает питоновские скаляры, которые bson умеет писать
+    for row in df.itertuples(index=False, name=None):
+        chunk.append(dict(zip(columns, row)))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_frame(collection, df: pd.DataFrame, date_col: str, chunk_size: int = CHUNK_SIZE) -> Counter:
+    """Upsert строк по (Ticker, date_col); возвращает rows, upserted, modified, seconds"""
+    stats = Counter()
+    start = time.perf_counter()
+    for chunk in iter_chunks(df, chunk_size):
+        result = collection.bulk_write([
+            pym.ReplaceOne({'Ticker': record['Ticker'], date_col: record[date_col]}, record, upsert=True)
+            for record in chunk
+        ], ordered=False)
+        stats.update(rows=len(chunk), upserted=result.upserted_count, modified=result.modified_count)
+    stats['seconds'] += time.perf_counter() - start
+    return stats
+
+
+def format_throughput(stats: Counter) -> str:
+    rows_per_sec = stats['rows'] / stats['seconds'] if stats['seconds'] else 0
+    return (f"{stats['rows']} rows ({stats['upserted']} new, {stats['modified']} updated) "
+            f"in {stats['seconds']:.1f}s, {rows_per_sec:.0f} rows/s")
@@ -0,0 +1,83 @@
+import json
+import ssl
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pymongo as pym
+from envparse import env
+
+
+ROOT_DIR = Path(__file__).parent.parent
+ADDITIONAL_DIR = ROOT_DIR / 'additional'
+
+# Порядок полей совпадает с GetLevelResponse на бэкенде
+RESPONSE_FIELDS = ['level_id', 'dates', 'prices', 'tones', 'volumes', 'news',
+                   'model_predict', 'target', 'Ticker', 'company_name', 'wiki_info']
+
+
+def get_date_range(end_date: str, days_back: int) -> dict:
+    """Дата -> номер дня уровня (с единицы)"""
+    end_date = datetime.strptime(end_date, "%Y-%m-%d")
+    start_date = end_date - timedelta(days=days_back)
+    return {
+        (start_date + timedelta(days=x)).strftime("%Y-%m-%d"): x + 1
+        for x in range(0, days_back + 1)
+    }
+
+
+def make_level_response(level: dict, model_id: str) -> str:
+    """
+    Собирает уровень в том виде, в котором его отдает бэкенд,
+    и сериализует в JSON. Бэкенд отдает эту строку как есть, поэтому
+    типы полей приводятся так же, как это делает GetLevelResponse
+    (номер дня новости - строка, ряды - float), а JSON - без пробелов, как orjson.
+    """
+    days_back = int(model_id.split('_')[1])
+    dates = get_date_range(level['date'], days_back)
+
+    response = {
+        'level_id': int(level['level_id']),
+        'dates': list(dates.keys()),
+        'prices': [float(x) for x in level['prices']],
+        'tones': [float(x) for x in level['tones']],
+        'volumes': [float(x) for x in level['volumes']],
+        'news': [[str(dates[day]), str(title)] for day, title in level['news']],
+        'model_predict': int(level['model_predict']),
+        'target': int(level['target']),
+        'Ticker': str(level['Ticker']),
+        'company_name': str(level['company_name']),
+        'wiki_info': None if level.get('wiki_info') is None else str(level['wiki_info']),
+    }
+
+    return json.dumps({field: response[field] for field in RESPONSE_FIELDS},
+                      ensure_ascii=False, separators=(',', ':'))
+
+
+def precompute_levels(db) -> None:
+    """Дописывает поле response во все уровни коллекций MODEL_*"""
+    for model_id in db.list_collection_names():
+        if not model_id.startswith('MODEL_'):
+            continue
+
+        db_model = db[model_id]
+        requests = []
+        for level in db_model.find({}, {'response': 0}):
+            requests.append(pym.UpdateOne({'_id': level['_id']},
+                                          {'$set': {'response': make_level_response(level, model_id)}}))
+
+        if requests:
+            db_model.bulk_write(requests, ordered=False)
+        print('MODEL:', model_id, 'LEVELS:', len(requests))
+
+
+def main():
+    env.read_envfile()
+    url = env("URL")
+    client = pym.MongoClient(url,
+                             ssl_ca_certs=str(ADDITIONAL_DIR / 'YandexInternalRootCA.crt'),
+                             ssl_cert_reqs=ssl.CERT_REQUIRED)
+    precompute_levels(client['stock-news-backend'])
+
+
+if __name__ == '__main__':
+    main()
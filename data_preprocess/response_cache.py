@@ -0,0 +1,120 @@
+"""
+Локальный кэш ответов GDELT и yfinance на диске.
+
+Ключ - хэш от (источник, тикер или ключевое слово, таймлайн, интервал, даты),
+значение - DataFrame в parquet. Периоды в прошлом не меняются, поэтому
+повторный прогон пайплайна (после падения или новой фичи) не ходит в сеть.
+Размер кэша ограничен: при превышении удаляются файлы, которые дольше всего
+не читались (время чтения - mtime файла). Общий размер считается один раз
+при создании и дальше ведется в памяти, папка обходится только при превышении.
+
+Переменные окружения:
+    RESPONSE_CACHE_DIR - папка кэша (по умолчанию data/cache)
+    RESPONSE_CACHE_MAX_MB - предел размера, МБ (2048)
+    RESPONSE_CACHE_OFFLINE - только кэш, без сети; промах - CacheMiss
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import date
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+import pandas as pd
+from envparse import env
+
+ROOT_DIR = Path(__file__).parent.parent
+CACHE_DIR = ROOT_DIR / 'data' / 'cache'
+CACHE_MAX_MB = 2048
+
+
+class CacheMiss(Exception):
+    """В офлайн-режиме ответа нет в кэше"""
+
+
+class ResponseCache:
+    def __init__(self, root: Path, max_bytes: int, offline: bool = False):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        self.total_bytes = sum(path.stat().st_size for path in self.root.rglob('*.parquet'))
+
+    def _path(self, key: Tuple) -> Path:
+        digest = hashlib.sha256(json.dumps(key, default=str).encode()).hexdigest()
+        return self.root / str(key[0]) / digest[:2] / f'{digest}.parquet'
+
+    def get(self, key: Tuple) -> Optional[pd.DataFrame]:
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            df = pd.read_parquet(path)
+        except Exception as e:
+            # недописанный или битый файл, скачаем заново
+            print('CACHE ERROR!', path, e)
+            return None
+        # отмечаем чтение для LRU
+        os.utime(path)
+        return df
+
+    def put(self, key: Tuple, df: pd.DataFrame) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        df.to_parquet(tmp_path, compression='zstd')
+        size = tmp_path.stat().st_size
+        with self._lock:
+            try:
+                # файл с тем же ключом заменяется, его размер уходит из суммы
+                old_size = path.stat().st_size
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            self.total_bytes += size - old_size
+            over = self.total_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self) -> int:
+        """Удаляет самые давно прочитанные файлы, пока кэш больше max_bytes"""
+        with self._lock:
+            files = [(path.stat(), path) for path in self.root.rglob('*.parquet')]
+            # заодно сверяем сумму с диском
+            self.total_bytes = sum(stat.st_size for stat, _ in files)
+            removed = 0
+            for stat, path in sorted(files, key=lambda item: item[0].st_mtime):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                self.total_bytes -= stat.st_size
+                removed += 1
+            return removed
+
+    def cached(self, key: Tuple, fetch: Callable[[], Optional[pd.DataFrame]],
+               end_date: str = None) -> Optional[pd.DataFrame]:
+        """
+        Ответ из кэша или fetch(). Пустые ответы и периоды, которые еще не закончились
+        (end_date сегодня или позже), не кэшируются: данные за них еще изменятся.
+        """
+        df = self.get(key)
+        if df is not None:
+            return df
+        if self.offline:
+            raise CacheMiss(f'{key} is not cached')
+
+        df = fetch()
+        if df is not None and not df.empty and (end_date is None or end_date < date.today().isoformat()):
+            self.put(key, df)
+        return df
+
+
+RESPONSE_CACHE = ResponseCache(
+    root=env('RESPONSE_CACHE_DIR', default=str(CACHE_DIR)),
+    max_bytes=env.int('RESPONSE_CACHE_MAX_MB', default=CACHE_MAX_MB) * 1024 * 1024,
+    offline=env.bool('RESPONSE_CACHE_OFFLINE', default=False),
+)
@@ -0,0 +1,107 @@
+import importlib.util
+import math
+import ssl
+from pathlib import Path
+from urllib.parse import urlparse
+
+import pymongo as pym
+from clickhouse_driver import Client
+from envparse import env
+
+
+ROOT_DIR = Path(__file__).parent.parent
+ADDITIONAL_DIR = ROOT_DIR / 'additional'
+
+QUERIES_PATH = ROOT_DIR / 'backend' / 'app' / 'db' / 'queries.py'
+
+BATCH_SIZE = 10000
+# Нативный протокол ClickHouse (clickhouse_driver); бэкенд ходит по http, адрес из того же CH_URL
+CH_NATIVE_PORT = 9440
+
+
+def load_queries():
+    """
+    Схема таблиц и список колонок - из backend/app/db/queries.py, чтобы не описывать их дважды.
+    Файл грузится напрямую: пакет app тянет зависимости бэкенда
+    """
+    spec = importlib.util.spec_from_file_location('backend_queries', QUERIES_PATH)
+    queries = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(queries)
+    return queries
+
+
+QUERIES = load_queries()
+
+
+def yfinance_field(column: str) -> str:
+    """adj_close -> Adj Close"""
+    return column.replace('_', ' ').title()
+
+
+def gdelt_field(column: str) -> str:
+    """average_tone_min -> Average_Tone_min"""
+    feature, stat = column.rsplit('_', 1)
+    return f"{feature.title()}_{stat}"
+
+
+# коллекция монги -> (источник в queries.TIMESERIES_TABLES, поле даты, колонка ClickHouse -> поле монги)
+SOURCES = {
+    'YFINANCE': ('yfinance', 'Date', {column: yfinance_field(column) for column in QUERIES.YFINANCE_COLUMNS}),
+    'GDELT': ('gdelt', 'datetime', {column: gdelt_field(column) for column in QUERIES.GDELT_COLUMNS}),
+}
+
+
+def to_float(value) -> float:
+    """Пропуски в монге бывают и None, и NaN, в ClickHouse кладем NaN"""
+    if value is None:
+        return math.nan
+    return float(value)
+
+
+def upload_collection(db, ch: Client, collection: str) -> int:
+    """Переливает коллекцию монги в таблицу ClickHouse пачками по BATCH_SIZE строк"""
+    source, date_field, fields = SOURCES[collection]
+    table, _ = QUERIES.TIMESERIES_TABLES[source]
+
+    insert = f"INSERT INTO {table} (ticker, date, {', '.join(fields)}) VALUES"
+    projection = {'_id': 0, 'Ticker': 1, date_field: 1, **{field: 1 for field in fields.values()}}
+    rows = []
+    total = 0
+    for doc in db[collection].find({}, projection, batch_size=BATCH_SIZE):
+        rows.append([doc['Ticker'], doc[date_field].date()] +
+                    [to_float(doc.get(field)) for field in fields.values()])
+        if len(rows) >= BATCH_SIZE:
+            ch.execute(insert, rows)
+            total += len(rows)
+            rows = []
+
+    if rows:
+        ch.execute(insert, rows)
+        total += len(rows)
+    print('COLLECTION:', collection, 'TABLE:', table, 'ROWS:', total)
+    return total
+
+
+def main():
+    env.read_envfile()
+    client = pym.MongoClient(env("URL"),
+                             ssl_ca_certs=str(ADDITIONAL_DIR / 'YandexInternalRootCA.crt'),
+                             ssl_cert_reqs=ssl.CERT_REQUIRED)
+    # CH_URL - http-адрес бэкенда (https://host:8443), отсюда берем только хост
+    ch_url = urlparse(env("CH_URL"))
+    ch = Client(host=ch_url.hostname,
+                user=env("CH_USER"),
+                password=env("CH_PASS"),
+                database=env("CH_DB"),
+                port=env.int("CH_NATIVE_PORT", default=CH_NATIVE_PORT),
+                secure=ch_url.scheme == 'https')
+    for query in QUERIES.CREATE_TIMESERIES_TABLES:
+        ch.execute(query)
+
+    db = client['stock-news-backend']
+    for collection in SOURCES:
+        upload_collection(db, ch, collection)
+
+
+if __name__ == '__main__':
+    main()
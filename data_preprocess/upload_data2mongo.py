@@ -1,22 +1,37 @@
 import json
 import random
 import ssl
-import time
 import urllib
-from datetime import timedelta
+from collections import Counter
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
 import pandas as pd
 import pymongo as pym
 import yfinance as yf
 from envparse import env
-from gdeltdoc import Filters, GdeltDoc
+
+from gdelt_fetcher import FETCHER
+from mongo_writer import ensure_indexes, format_throughput, write_frame
+from response_cache import RESPONSE_CACHE
+from yfinance_loader import download_prices
 
 
 ROOT_DIR = Path(__file__).parent.parent
 DATA_DIR = ROOT_DIR / 'data'
 ADDITIONAL_DIR = ROOT_DIR / 'additional'
 
+# С какой даты грузим тикер, по которому еще ничего не загружено
+START_DATE = "2017-01-01"
+# Сколько дней до отметки загрузки перекачиваем заново: изменение цены
+# считается от предыдущего торгового дня, а крайние дни GDELT отбрасываются
+LOOKBACK_DAYS = 7
+# Сколько новых тикеров добавлять за один запуск
+NEW_TICKERS = 40
+
+# Коллекция и колонка даты для каждого источника
+SOURCES = {'YFINANCE': 'Date', 'GDELT': 'datetime'}
+
 
 def get_shift_percentage(numerator: pd.Series,
                          denominator: pd.Series) -> pd.Series:
@@ -40,21 +55,31 @@ def get_shift_digit(s: pd.Series) -> pd.Series:
 def get_data_yfinance(quotation: str,
                       start_date: str,
                       end_date: str,
-                      interval='1d') -> pd.DataFrame:
+                      interval='1d',
+                      prices: pd.DataFrame = None) -> pd.DataFrame:
     """
     Взять данные с yahoo finance
     params:
         quotation: название котировки, данные для которой хотим получить
         start_date, end_date - интервал, формат "год-месяц-день"
         interval - периодичность, формат "(номер)(первая буква слова (d, m, y))"
+        (опционально) prices - уже скачанные цены тикера (см. yfinance_loader.download_prices)
     returns:
         DataFrame формата "Тикет, Время, 6 видов цен"
     """
 
-    df_res = yf.download(tickers=quotation,
-                         start=start_date,
-                         end=end_date,
-                         interval=interval)
+    if prices is not None:
+        df_res = prices.copy()
+    else:
+        # история за прошедший период не меняется, поэтому берем ее из дискового кэша
+        df_res = RESPONSE_CACHE.cached(
+            ('yfinance', quotation, interval, start_date, end_date),
+            lambda: yf.download(tickers=quotation,
+                                start=start_date,
+                                end=end_date,
+                                interval=interval),
+            end_date=end_date,
+        )
     df_res.loc[:, 'Ticker'] = quotation
     df_res = df_res.groupby(pd.Grouper(level="Date",
                                        freq=interval.upper())).mean()
@@ -92,17 +117,16 @@ def get_data_gdelt(quotation: str,
     match_list = ["timelinetone", "timelinevolraw", "timelinevol"]
     match_dict = dict(zip(match_list, col_names))
 
+    # Все таймлайны всех ключевых слов качаем параллельно под общим лимитом запросов
+    timelines = FETCHER.fetch_timelines(keywords, match_list, start_date, end_date)
+
     df_res = None
     for keyword in keywords:
         try:
-            gd_filter = Filters(start_date=start_date,
-                                end_date=end_date,
-                                keyword=keyword)
-
             for feature_name in match_list:
-                gd = GdeltDoc()
-                timeline_data = gd.timeline_search(feature_name, gd_filter)
-                time.sleep(5)
+                timeline_data = timelines[(keyword, feature_name)]
+                if timeline_data is None:
+                    raise ValueError(f'no {feature_name} timeline')
                 timeline_data = timeline_data.fillna(0)
                 timeline_data = timeline_data.groupby(
                     pd.Grouper(key="datetime", freq=interval.upper()))
@@ -187,11 +211,11 @@ def set_cumulative_effect(df: pd.DataFrame, chains: list) -> None:
 
     for chain in chains:
         buffer = None
-        for date in chain:
+        for nan_day in chain:
             if buffer is None:
-                buffer = df.loc[date]
+                buffer = df.loc[nan_day]
             else:
-                buffer += df.loc[date]
+                buffer += df.loc[nan_day]
 
         cumulative_day = chain[-1] + day
         # Берем все дни из цепочки, в строке будет среднее арифметическое этих дней
@@ -199,7 +223,7 @@ def set_cumulative_effect(df: pd.DataFrame, chains: list) -> None:
                                   buffer) / (len(chain) + 1)
 
 
-def get_dataframe_v2(**kwargs) -> (pd.DataFrame, pd.DataFrame):
+def get_dataframe_v2(prices: pd.DataFrame = None, **kwargs) -> (pd.DataFrame, pd.DataFrame):
     """
     Получить полный датафрейм с кумулятивностью и дополнительными фичами
     Пример использования: d = get_dataframe(quotation='NVDA',
@@ -214,6 +238,7 @@ def get_dataframe_v2(**kwargs) -> (pd.DataFrame, pd.DataFrame):
         (опционально) interval - периодичность, формат "(номер)(первая буква слова (d, m, y))"
         (не реализована) (опционально) num_records - сколько максимум записей взять за промежуток
         (не реализовано) (опционально) repeats - сколько раз должно повториться ключевое слово в статье
+        (опционально) prices - уже скачанные цены тикера, тогда yfinance не запрашивается
     returns:
         DataFrame формата "Datetime (индекс), Ticker,
         [Average_Tone, Article_Count, Volume_Intensity]_[std, mean, sum, min, max], - из новостей
@@ -225,7 +250,8 @@ def get_dataframe_v2(**kwargs) -> (pd.DataFrame, pd.DataFrame):
         quotation=kwargs['quotation'],
         start_date=kwargs['start_date'],
         end_date=kwargs['end_date'],
-        interval="1d" if not kwargs.get('interval') else kwargs['interval'])
+        interval="1d" if not kwargs.get('interval') else kwargs['interval'],
+        prices=prices)
 
     row_is_nan = yfinance_data['Close'].isna()
     yfinance_data.dropna(inplace=True)
@@ -273,50 +299,145 @@ def get_keywords_full(path):
     return keywords
 
 
-def parse_dataframes_to_mongo(data_json, ssl_path=None):
+def get_watermarks(db, ticker: str, field: str = 'date') -> dict:
+    """
+    Отметки тикера по каждому источнику, "год-месяц-день" или None:
+    date - последний записанный день, fetched - по какой день скачан и обработан период
+    """
+    watermarks = dict.fromkeys(SOURCES)
+    for doc in db['WATERMARKS'].find({'Ticker': ticker}):
+        watermarks[doc['source']] = doc.get(field)
+    return watermarks
+
+
+def set_watermark(db, ticker: str, source: str, last_date: str = None, fetched: str = None) -> None:
+    # $max: отметка только растет, даже если перекачали старый период
+    marks = {'date': last_date, 'fetched': fetched}
+    db['WATERMARKS'].update_one({'_id': f'{source}:{ticker}'},
+                                {'$max': {field: value for field, value in marks.items() if value is not None},
+                                 '$set': {'Ticker': ticker, 'source': source, 'updated': datetime.utcnow()}},
+                                upsert=True)
+
+
+def seed_watermarks(db) -> None:
+    """
+    Отметки для тикеров, загруженных до появления WATERMARKS: берем последнюю дату
+    из самой коллекции, иначе такие тикеры считаются новыми и перекачиваются с START_DATE.
+    Делается один раз - пока по источнику нет ни одной отметки.
+    """
+    for source, date_col in SOURCES.items():
+        if db['WATERMARKS'].count_documents({'source': source}, limit=1):
+            continue
+        pipeline = [{'$group': {'_id': '$Ticker', 'last': {'$max': f'${date_col}'}}}]
+        seeded = 0
+        for doc in db[source].aggregate(pipeline, allowDiskUse=True):
+            if doc['_id'] is None or doc['last'] is None:
+                continue
+            set_watermark(db, doc['_id'], source, doc['last'].strftime('%Y-%m-%d'))
+            seeded += 1
+        print('SEEDED WATERMARKS:', source, seeded)
+
+
+def get_fetch_start(watermarks: dict) -> str:
+    """
+    С какой даты качать тикер: от самой отстающей отметки минус LOOKBACK_DAYS,
+    с START_DATE, если по какому-то источнику ничего нет
+    """
+    if any(watermark is None for watermark in watermarks.values()):
+        return START_DATE
+    start = date.fromisoformat(min(watermarks.values())) - timedelta(days=LOOKBACK_DAYS)
+    return max(start.isoformat(), START_DATE)
+
+
+def select_new_rows(df: pd.DataFrame, date_col: str, watermark: str = None) -> pd.DataFrame:
+    """Строки позже отметки загрузки"""
+    if watermark is None:
+        return df
+    return df[df[date_col].dt.strftime('%Y-%m-%d') > watermark]
+
+
+def parse_dataframes_to_mongo(data_json, ssl_path=None, end_date=None, new_tickers=NEW_TICKERS):
+    """
+    Инкрементальная загрузка: для каждого тикера качается только период после
+    отметки загрузки (коллекция WATERMARKS, отдельно для YFINANCE и GDELT).
+    Обновляются все уже загруженные тикеры и добавляется до new_tickers новых.
+    end_date (не включительно) - по умолчанию сегодня.
+    """
     env.read_envfile()
     url = env("URL")
     client = pym.MongoClient(url,
                              ssl_ca_certs=ssl_path,
                              ssl_cert_reqs=ssl.CERT_REQUIRED)
     db = client['stock-news-backend']
-    db_gdelt = db['GDELT']
-    db_yfinance = db['YFINANCE']
     db_keywords = db['KEYWORDS']
 
     # db_gdelt.drop()
     # db_yfinance.drop()
 
+    end_date = end_date or date.today().isoformat()
+    last_day = (date.fromisoformat(end_date) - timedelta(days=1)).isoformat()
+
     calendar_tickers = pd.read_csv(DATA_DIR / 'calendar.csv')
     calendar_tickers_unique = calendar_tickers['Ticker'].unique()
 
-    #     db_gdelt.create_index([("datetime", pym.ASCENDING),("Ticker", pym.ASCENDING)], unique=True)
-    #     db_yfinance.create_index([("Date", pym.ASCENDING),("Ticker", pym.ASCENDING)], unique=True)
+    for source, date_col in SOURCES.items():
+        ensure_indexes(db[source], date_col)
+    seed_watermarks(db)
 
     with open(data_json) as json_file:
         data = json.load(json_file)
 
-        # for i in range(len(data)):
-    for i in random.sample(range(1, len(calendar_tickers_unique)), 40):
-        try:
-            ticker = calendar_tickers_unique[i]
-
-            if db_yfinance.find_one({"Ticker": ticker}):
-                continue
-
-            print('TICKER:', ticker)
-            keywords = db_keywords.find_one({"Ticker": ticker}, {'_id': 0})['Keywords']
-
-            print('PARSED KEYWORDS', keywords)
-            df_gdelt, df_yfinance = get_dataframe_v2(quotation=ticker,
-                                                     keywords=keywords,
-                                                     start_date="2017-01-01",
-                                                     end_date="2020-12-31")
-
-            db_gdelt.insert_many(df_gdelt.to_dict('records'))
-            db_yfinance.insert_many(df_yfinance.to_dict('records'))
-        except Exception as e:
-            print('ERROR!', e)
+    loaded = set(db['WATERMARKS'].distinct('Ticker'))
+    new = [ticker for ticker in calendar_tickers_unique if ticker not in loaded]
+    tickers = [ticker for ticker in calendar_tickers_unique if ticker in loaded]
+    tickers += random.sample(new, min(new_tickers, len(new)))
+
+    # тикеры с одинаковой датой начала качаем одним пакетом
+    watermarks, starts, totals = {}, {}, {source: Counter() for source in SOURCES}
+    for ticker in tickers:
+        watermarks[ticker] = get_watermarks(db, ticker)
+        # по date не понять: последний день GDELT отбрасывается (iloc[1:-1]), в выходные нет торгов
+        fetched = get_watermarks(db, ticker, 'fetched')
+        if all(day is not None and day >= last_day for day in fetched.values()):
+            continue
+        starts.setdefault(get_fetch_start(watermarks[ticker]), []).append(ticker)
+
+    for start_date, start_tickers in sorted(starts.items()):
+        print('PERIOD:', start_date, end_date, 'TICKERS:', len(start_tickers))
+        prices = download_prices(start_tickers, start_date=start_date, end_date=end_date)
+
+        for ticker in start_tickers:
+            try:
+                if ticker not in prices:
+                    print('NO PRICES:', ticker)
+                    continue
+
+                print('TICKER:', ticker)
+                keywords = db_keywords.find_one({"Ticker": ticker}, {'_id': 0})['Keywords']
+
+                print('PARSED KEYWORDS', keywords)
+                df_gdelt, df_yfinance = get_dataframe_v2(quotation=ticker,
+                                                         keywords=keywords,
+                                                         start_date=start_date,
+                                                         end_date=end_date,
+                                                         prices=prices[ticker])
+
+                for source, df in (('GDELT', df_gdelt), ('YFINANCE', df_yfinance)):
+                    date_col = SOURCES[source]
+                    df = select_new_rows(df, date_col, watermarks[ticker][source])
+                    last_written = None
+                    if not df.empty:
+                        stats = write_frame(db[source], df, date_col)
+                        totals[source].update(stats)
+                        print(source, ticker, format_throughput(stats))
+                        last_written = df[date_col].max().strftime('%Y-%m-%d')
+                    # отметки двигаем только после успешной записи: date - по последней записанной строке
+                    set_watermark(db, ticker, source, last_date=last_written, fetched=last_day)
+            except Exception as e:
+                print('ERROR!', e)
+
+    for source, stats in totals.items():
+        print('TOTAL', source, format_throughput(stats))
 
 
 def main():
@@ -0,0 +1,90 @@
+"""
+Пакетная загрузка цен yfinance.
+
+yf.download принимает сразу много тикеров и качает их параллельно, поэтому
+вселенную тикеров грузим пачками по CHUNK_SIZE и режем результат на
+DataFrame по тикерам в том же виде, что отдает yf.download для одного тикера.
+Уже скачанные периоды берутся из дискового кэша (см. response_cache) под теми же
+ключами, что и в get_data_yfinance, так что кэш у них общий.
+
+Пример:
+    prices = download_prices(load_universe(), start_date="2017-01-01", end_date="2020-12-31")
+    prices['NVDA']  # Open, High, Low, Close, Adj Close, Volume по дням
+"""
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import pandas as pd
+import yfinance as yf
+
+from response_cache import RESPONSE_CACHE
+
+ROOT_DIR = Path(__file__).parent.parent
+DATA_DIR = ROOT_DIR / 'data'
+ADDITIONAL_DIR = ROOT_DIR / 'additional'
+
+CHUNK_SIZE = 100
+
+
+def load_universe(source: str = 'calendar') -> List[str]:
+    """Тикеры из data/calendar.csv (source='calendar') или additional/stocks.json (source='stocks')"""
+    if source == 'calendar':
+        return list(pd.read_csv(DATA_DIR / 'calendar.csv')['Ticker'].unique())
+
+    with open(ADDITIONAL_DIR / 'stocks.json') as json_file:
+        return [stock['ticket'] for stock in json.load(json_file)]
+
+
+def _split_tickers(df: pd.DataFrame, tickers: List[str]) -> Dict[str, pd.DataFrame]:
+    """Результат yf.download(group_by='ticker') -> тикер: DataFrame с обычными колонками"""
+    if not isinstance(df.columns, pd.MultiIndex):
+        # один тикер yf.download отдает без уровня тикера
+        return {tickers[0]: df}
+
+    res = {}
+    for ticker in tickers:
+        if ticker not in df.columns.get_level_values(0):
+            continue
+        # строки, где торговался только кто-то другой из пачки
+        df_ticker = df[ticker].dropna(how='all')
+        if not df_ticker.empty:
+            res[ticker] = df_ticker
+    return res
+
+
+def download_prices(tickers: Iterable[str],
+                    start_date: str,
+                    end_date: str,
+                    interval: str = '1d',
+                    chunk_size: int = CHUNK_SIZE) -> Dict[str, pd.DataFrame]:
+    """
+    Цены всех тикеров за период: тикер -> DataFrame формата yf.download.
+    Тикеры, по которым yfinance ничего не вернул, в ответ не попадают.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    prices = {}
+    missing = []
+    for ticker in tickers:
+        df = RESPONSE_CACHE.get(('yfinance', ticker, interval, start_date, end_date))
+        if df is not None:
+            prices[ticker] = df
+        else:
+            missing.append(ticker)
+
+    for i in range(0, len(missing), chunk_size):
+        chunk = missing[i:i + chunk_size]
+        print('YFINANCE CHUNK:', i // chunk_size + 1, 'TICKERS:', len(chunk))
+        df = yf.download(tickers=chunk,
+                         start=start_date,
+                         end=end_date,
+                         interval=interval,
+                         group_by='ticker',
+                         threads=True)
+
+        for ticker, df_ticker in _split_tickers(df, chunk).items():
+            prices[ticker] = df_ticker
+            RESPONSE_CACHE.cached(('yfinance', ticker, interval, start_date, end_date),
+                                  lambda: df_ticker, end_date=end_date)
+
+    return prices
@@ -1,4 +1,7 @@
 
 BACKEND_URL = "https://stock-news.site/backend"
 #
-# BACKEND_URL = "http://localhost:8080/backend"
\ No newline at end of file
+# BACKEND_URL = "http://localhost:8080/backend"
+
+# Сколько уровней забираем за один запрос к бэкенду
+LEVELS_BATCH = 10
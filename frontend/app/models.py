@@ -4,6 +4,7 @@ from pydantic import BaseModel
 
 
 class Level(BaseModel):
+    level_id: int = None
     dates: List[str]
     prices: List[float]
     tones: List[float]
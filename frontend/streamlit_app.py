@@ -1,4 +1,5 @@
-from typing import Dict
+import random
+from typing import Dict, Optional
 
 import pandas as pd
 import streamlit as st
@@ -6,7 +7,7 @@ import altair as alt
 import requests
 
 from app.SessionState import SessionState, get
-from app.consts import BACKEND_URL
+from app.consts import BACKEND_URL, LEVELS_BATCH
 from app.models import Level
 
 
@@ -21,8 +22,27 @@ def _method(suburl, data=None) -> Dict:
         return requests.get(f'{BACKEND_URL}{suburl}',).json()
 
 
+@st.cache(allow_output_mutation=True)
+def _etag_store() -> Dict:
+    # переживает перезапуски скрипта: url -> (etag, json)
+    return {}
+
+
+def _get_with_etag(suburl) -> Dict:
+    store = _etag_store()
+    etag, data = store.get(suburl, (None, None))
+    headers = {'If-None-Match': etag} if etag else {}
+    response = requests.get(f'{BACKEND_URL}{suburl}', headers=headers)
+    if response.status_code == 304:
+        return data
+
+    data = response.json()
+    store[suburl] = (response.headers.get('ETag'), data)
+    return data
+
+
 def model_names() -> Dict:
-    data = _method('/get_model_names/')
+    data = _get_with_etag('/get_model_names/')
     data = data['data']
     d = {}
     for item in data:
@@ -30,16 +50,54 @@ def model_names() -> Dict:
     return d
 
 
+def create_session() -> Optional[str]:
+    # без сессии (например, 503 при WORKERS > 1 без монги) счет считаем на клиенте
+    response = requests.post(f'{BACKEND_URL}/sessions/', json={})
+    if response.status_code != 200:
+        return None
+    return response.json().get('session_id')
+
+
+def post_answer(session_id: str, model_id: str, level: Level, answer) -> Dict:
+    # счет считает бэкенд, answer=None - пропуск уровня
+    return requests.post(f'{BACKEND_URL}/answers/', json={
+        'session_id': session_id,
+        'model_id': model_id,
+        'level_id': level.level_id,
+        'answer': answer,
+    }).json()
+
+
+def show_leaderboard(session_id: str):
+    leaderboard = requests.get(f'{BACKEND_URL}/leaderboard/').json().get('data')
+    if not leaderboard:
+        return
+    st.sidebar.markdown('### Таблица лидеров')
+    for item in leaderboard:
+        name = item['name'] or item['session_id'][:6]
+        if item['session_id'] == session_id:
+            name = f'**{name} (Вы)**'
+        st.sidebar.markdown(f"{item['rank']}. {name} - {item['user_score']}:{item['model_score']}")
+
+
 # @st.cache(ttl=100)
-def get_level(level_id: int, model_id: str) -> Level:
-    level_json = _method('/get_level/', data={
-        'level_id': level_id,
-        'model_id': model_id
+def get_level(step: int, model_id: str, seed: int) -> Level:
+    # Уровни забираем пачками: _method закэширован, поэтому следующие
+    # LEVELS_BATCH уровней не требуют похода в бэкенд.
+    # seed задает свой порядок уровней для каждой сессии
+    start = step - step % LEVELS_BATCH
+    levels_json = _method('/get_levels/', data={
+        'model_id': model_id,
+        'start': start,
+        'stop': start + LEVELS_BATCH,
+        'seed': seed
     })
-    # st.write(level_json)
-    if level_json.get('status'):
+    # st.write(levels_json)
+    if levels_json.get('status'):
+        return None
+    if step - start >= len(levels_json['data']):
         return None
-    return Level.parse_obj(level_json)
+    return Level.parse_obj(levels_json['data'][step - start])
 
 
 def plot_level(level: Level):
@@ -112,7 +170,10 @@ def main():
     load_styles()
     SessionState(level=0, model_score=0, user_score=0)
 
-    get_state = get(level=0, model_score=0, user_score=0)
+    get_state = get(level=0, model_score=0, user_score=0, seed=random.randrange(2 ** 31), session_id=None)
+    if get_state.session_id is None:
+        # '' - сессию создать не удалось, играем без нее и больше не пробуем
+        get_state.session_id = create_session() or ''
     # st.title(f'Вы {get_state.user_score}:{get_state.model_score} Модель')
     st.markdown('## Stock News!')
 
@@ -123,12 +184,7 @@ def main():
         format_func=lambda x: model_names_d[x]
     )
 
-    level: Level = get_level(get_state.level, model_id)
-
-    def score_round(level: Level, user_answer):
-        if level.target == user_answer:
-            get_state.user_score += 1
-
+    level: Level = get_level(get_state.level, model_id, get_state.seed)
 
     if not level:
         st.write('На сегодня Ваши уровни закончились :)')
@@ -141,19 +197,18 @@ def main():
         st.title(_str)
 
         def score_round(answer):
-            nonlocal level
-            if level.target == answer and level.model_predict == level.target:
-                get_state.user_score += 1
-                get_state.model_score += 1
-                get_state.level += 1
-            elif level.target != answer and level.model_predict == level.target:
-                get_state.model_score += 1
-                get_state.level += 1
-            elif level.target == answer and level.model_predict != level.target:
-                get_state.user_score += 1
+            if not get_state.session_id:
+                get_state.user_score += int(answer is not None and answer == level.target)
+                get_state.model_score += int(answer is not None and level.model_predict == level.target)
                 get_state.level += 1
+                return
+            session = post_answer(get_state.session_id, model_id, level, answer)
+            if session.get('status'):
+                st.warning(f"Ответ не засчитан: {session['status']}")
             else:
-                get_state.level += 1
+                get_state.user_score = session['user_score']
+                get_state.model_score = session['model_score']
+            get_state.level += 1
 
         st.markdown(f'### Company name: {level.company_name}')
         if level.wiki_info:
@@ -165,12 +220,14 @@ def main():
         if col3.button('Растет!'):
             score_round(1)
         if col2.button('Пропуск'):
-            get_state.level += 1
+            score_round(None)
         if col1.button('Падает!'):
             score_round(0)
         st.altair_chart(chart, use_container_width=True)
         show_news(level)
 
+    show_leaderboard(get_state.session_id)
+
 
     # st.markdown(f'# Человек {get_state.user_score}:{get_state.model_score} Модель')
 